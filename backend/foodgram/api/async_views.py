@@ -0,0 +1,47 @@
+"""Асинхронные представления вьюсетов для запуска под ASGI.
+
+Маршруты роутера остаются теми же, меняется только представление:
+методы, действие которых есть в async_actions вьюсета, выполняются
+корутиной AsyncReadMixin.adispatch, остальные передаются синхронному
+представлению DRF через sync_to_async.
+"""
+from asgiref.sync import sync_to_async
+from django.urls import URLPattern
+
+
+def async_view(view):
+    """Оборачивает представление, созданное ViewSet.as_view()."""
+    viewset, actions = view.cls, view.actions
+    sync_view = sync_to_async(view)
+
+    async def wrapper(request, *args, **kwargs):
+        method = request.method.lower()
+        action = actions.get('get' if method == 'head' else method)
+        if action not in viewset.async_actions:
+            return await sync_view(request, *args, **kwargs)
+        self = viewset(**view.initkwargs)
+        self.action_map = actions
+        return await self.adispatch(request, *args, **kwargs)
+
+    # Атрибуты DRF нужны метрикам, бюджетам запросов и CSRF.
+    wrapper.cls = viewset
+    wrapper.initkwargs = view.initkwargs
+    wrapper.actions = actions
+    wrapper.csrf_exempt = True
+    wrapper.__name__ = view.__name__
+    wrapper.__doc__ = view.__doc__
+    return wrapper
+
+
+def async_urls(urls):
+    """Маршруты роутера с асинхронными представлениями, где они есть."""
+    patterns = []
+    for pattern in urls:
+        view = pattern.callback
+        async_actions = getattr(getattr(view, 'cls', None),
+                                'async_actions', ())
+        if set(async_actions) & set(getattr(view, 'actions', {}).values()):
+            pattern = URLPattern(pattern.pattern, async_view(view),
+                                 pattern.default_args, pattern.name)
+        patterns.append(pattern)
+    return patterns
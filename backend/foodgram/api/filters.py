@@ -21,6 +21,7 @@ class RecipeFilter(FilterSet):
     )
     is_favorited = filters.BooleanFilter(method='favorited')
     is_in_shopping_cart = filters.BooleanFilter(method='shopping_cart')
+    search = filters.CharFilter(method='search_recipes')
 
     def favorited(self, queryset, name, value):
         if self.request.user.is_anonymous:
@@ -36,6 +37,10 @@ class RecipeFilter(FilterSet):
             return queryset.filter(shopping_cart__user=self.request.user)
         return queryset
 
+    def search_recipes(self, queryset, name, value):
+        return queryset.search(value)
+
     class Meta:
         model = Recipe
-        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart']
+        fields = ['tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search']
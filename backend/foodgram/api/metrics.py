@@ -0,0 +1,206 @@
+"""Метрики запросов к API в текстовом формате Prometheus.
+
+Каждый процесс копит значения в памяти. Все метрики - счётчики
+(гистограммы раскладываются на счётчики _bucket, _sum и _count),
+поэтому значения разных воркеров gunicorn просто складываются. Если
+задан METRICS_DIR, процесс периодически записывает свои значения в
+отдельный файл каталога, а эндпоинт суммирует все файлы. Файлы
+прошлого запуска удаляет хук on_starting в gunicorn.conf.py.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from math import inf
+
+from django.conf import settings
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75,
+                    1, 2.5, 5, 7.5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+SIZE_BUCKETS = (100, 1000, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7)
+SETUP_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25)
+
+# имя: (тип, описание)
+METRICS = {
+    'foodgram_http_requests_total': (
+        'counter', 'Запросы по действию, методу и статусу ответа'),
+    'foodgram_http_request_duration_seconds': (
+        'histogram', 'Время обработки запроса'),
+    'foodgram_http_response_size_bytes': (
+        'histogram', 'Размер тела ответа'),
+    'foodgram_db_queries': (
+        'histogram', 'Число SQL-запросов на запрос к API'),
+    'foodgram_db_query_duration_seconds_total': (
+        'counter', 'Суммарное время SQL-запросов'),
+    'foodgram_db_connections_total': (
+        'counter', 'Запросы к API, обращавшиеся к базе, по источнику '
+                   'соединения: new, pool, persistent'),
+    'foodgram_db_connection_setup_seconds': (
+        'histogram', 'Время установки соединения с базой на запрос, '
+                     'включая проверку связи'),
+}
+
+
+def action_label(func, method):
+    """Имя действия: 'RecipeViewSet.list' для вьюсетов DRF."""
+    view = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    if view is None:
+        return None, None
+    actions = getattr(func, 'actions', None) or {}
+    name = actions.get(method.lower(), method.lower())
+    return f'{view.__name__}.{name}', view
+
+
+class Registry:
+    """Значения метрик процесса: {(имя, метки): значение}."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # После fork воркер не должен повторно отдавать значения,
+        # унаследованные от мастера gunicorn.
+        self.pid = os.getpid()
+        self.path = None
+        self.flushed = 0
+        self.samples = defaultdict(float)
+
+    def check_pid(self):
+        if self.pid != os.getpid():
+            self.reset()
+
+    def inc(self, name, labels, value=1):
+        self.samples[name, labels] += value
+
+    def observe(self, name, labels, value, buckets):
+        for bucket in (*buckets, inf):
+            if value <= bucket:
+                self.inc(f'{name}_bucket',
+                         (*labels, ('le', format_value(bucket))))
+        self.inc(f'{name}_sum', labels, value)
+        self.inc(f'{name}_count', labels)
+
+    def record(self, route, method, status, duration, queries,
+               query_time, size=None, connection=None):
+        labels = (('route', route), ('method', method))
+        with self.lock:
+            self.check_pid()
+            self.inc('foodgram_http_requests_total',
+                     (*labels, ('status', str(status))))
+            self.observe('foodgram_http_request_duration_seconds', labels,
+                         duration, DURATION_BUCKETS)
+            self.observe('foodgram_db_queries', labels, queries,
+                         QUERY_BUCKETS)
+            self.inc('foodgram_db_query_duration_seconds_total', labels,
+                     query_time)
+            if size is not None:
+                self.observe('foodgram_http_response_size_bytes', labels,
+                             size, SIZE_BUCKETS)
+            if connection is not None:
+                source, setup_time = connection
+                self.inc('foodgram_db_connections_total',
+                         (*labels, ('source', source)))
+                self.observe('foodgram_db_connection_setup_seconds', labels,
+                             setup_time, SETUP_BUCKETS)
+        self.flush()
+
+    def record_size(self, route, method, size):
+        with self.lock:
+            self.check_pid()
+            self.observe('foodgram_http_response_size_bytes',
+                         (('route', route), ('method', method)), size,
+                         SIZE_BUCKETS)
+
+    def flush(self, force=False):
+        """Записывает значения процесса в METRICS_DIR не чаще интервала."""
+        if not settings.METRICS_DIR:
+            return
+        now = time.monotonic()
+        if not force and now - self.flushed < settings.METRICS_FLUSH_INTERVAL:
+            return
+        with self.lock:
+            self.check_pid()
+            self.flushed = now
+            if self.path is None:
+                # Время запуска в имени файла: новый процесс с тем же pid
+                # не перезапишет значения прежнего.
+                self.path = os.path.join(
+                    settings.METRICS_DIR,
+                    f'{self.pid}-{time.time_ns()}.json')
+            data = [[name, labels, value]
+                    for (name, labels), value in self.samples.items()]
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        temporary = f'{self.path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(data, file)
+        os.replace(temporary, self.path)
+
+    def collect(self):
+        """Суммы значений всех процессов."""
+        if not settings.METRICS_DIR:
+            with self.lock:
+                self.check_pid()
+                return dict(self.samples)
+        self.flush(force=True)
+        totals = defaultdict(float)
+        for entry in os.scandir(settings.METRICS_DIR):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path, encoding='utf-8') as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, labels, value in data:
+                totals[name, tuple(map(tuple, labels))] += value
+        return totals
+
+
+registry = Registry()
+
+
+def format_value(value):
+    if value == inf:
+        return '+Inf'
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+def escape(value):
+    return (value.replace('\\', r'\\').replace('"', r'\"')
+            .replace('\n', r'\n'))
+
+
+def render_metrics():
+    """Текст для Prometheus, строки метрики сгруппированы по её имени."""
+    samples = defaultdict(list)
+    for (name, labels), value in registry.collect().items():
+        for base in METRICS:
+            if name == base or name.startswith(f'{base}_'):
+                samples[base].append((name, labels, value))
+                break
+    lines = []
+    for base, (kind, description) in METRICS.items():
+        lines.append(f'# HELP {base} {description}')
+        lines.append(f'# TYPE {base} {kind}')
+        for name, labels, value in sorted(
+                samples[base], key=lambda sample: sample_key(*sample)):
+            label_text = ','.join(f'{key}="{escape(label)}"'
+                                  for key, label in labels)
+            lines.append(f'{name}{{{label_text}}} {format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def sample_key(name, labels, value):
+    # Бакеты гистограммы идут по возрастанию границы, +Inf - последним.
+    labels = dict(labels)
+    le = labels.pop('le', None)
+    bound = inf if le == '+Inf' else float(le) if le else 0
+    return sorted(labels.items()), name, bound
@@ -0,0 +1,339 @@
+import cProfile
+import os
+import pstats
+import time
+from contextlib import suppress
+from datetime import datetime
+from io import StringIO
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .metrics import action_label, registry
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = 'profile'
+PROFILE_LINES = 60
+
+
+def connection_usage():
+    """Счётчики соединений бэкенда (foodgram.db.pool) или None."""
+    usage = getattr(connection, 'connection_usage', None)
+    return usage() if usage is not None else None
+
+
+class QueryTimer:
+    """Число и суммарное время SQL-запросов через execute_wrapper.
+
+    С record=True сохраняет и сами запросы: (время, SQL, параметры).
+    В connection после выхода - откуда запрос взял соединение с базой
+    (new, pool, persistent) и сколько секунд ушло на его установку, если
+    бэкенд ведёт такой учёт и запрос обращался к базе.
+    """
+
+    def __init__(self, record=False):
+        self.count = 0
+        self.duration = 0
+        self.queries = [] if record else None
+        self.usage = None
+        self.connection = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.count += 1
+            self.duration += elapsed
+            if self.queries is not None:
+                self.queries.append((elapsed, sql, params))
+
+    def __enter__(self):
+        connection.execute_wrappers.append(self)
+        self.usage = connection_usage()
+        return self
+
+    def __exit__(self, *exc_info):
+        connection.execute_wrappers.remove(self)
+        if self.usage is None or not self.count:
+            return
+        opened, pooled, setup_time = (
+            after - before
+            for after, before in zip(connection_usage(), self.usage))
+        source = 'new' if opened else 'pool' if pooled else 'persistent'
+        self.connection = (source, setup_time)
+
+
+async def atimed(timer, get_response, request):
+    """QueryTimer для асинхронной цепочки middleware.
+
+    Под ASGI ORM работает в отдельном потоке запроса со своим
+    соединением, поэтому обёртка ставится на соединение этого потока.
+    """
+    await sync_to_async(timer.__enter__)()
+    try:
+        return await get_response(request)
+    finally:
+        await sync_to_async(timer.__exit__)()
+
+
+def route_label(request):
+    """Метка маршрута: действие вьюсета, имя URL или 'unmatched'.
+
+    Метка не содержит параметров пути, иначе число рядов метрик росло бы
+    с числом рецептов и пользователей.
+    """
+    match = request.resolver_match
+    if match is None:
+        return 'unmatched'
+    label, _ = action_label(match.func, request.method)
+    return label or match.view_name or 'unmatched'
+
+
+def count_bytes(content, route, method):
+    size = 0
+    for chunk in content:
+        size += len(chunk)
+        yield chunk
+    registry.record_size(route, method, size)
+
+
+async def acount_bytes(content, route, method):
+    size = 0
+    async for chunk in content:
+        size += len(chunk)
+        yield chunk
+    registry.record_size(route, method, size)
+
+
+class MetricsMiddleware:
+    """Время, SQL-запросы, статус и размер ответа по действиям API."""
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with timer:
+            response = self.get_response(request)
+        return self.record(request, response, timer, start)
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        response = await atimed(timer, self.get_response, request)
+        return self.record(request, response, timer, start)
+
+    def record(self, request, response, timer, start):
+        duration = time.perf_counter() - start
+        route, method = route_label(request), request.method
+        size = None
+        if response.streaming:
+            # Размер потокового ответа известен только после отдачи.
+            wrapper = acount_bytes if response.is_async else count_bytes
+            response.streaming_content = wrapper(
+                response.streaming_content, route, method)
+        else:
+            size = len(response.content)
+        registry.record(route, method, response.status_code, duration,
+                        timer.count, timer.duration, size, timer.connection)
+        return response
+
+
+class CProfiler:
+    """Детерминированный профилировщик из стандартной библиотеки."""
+    name = 'cProfile'
+    extension = 'prof'
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profile.disable()
+
+    def text(self):
+        stream = StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats(
+            'cumulative').print_stats(PROFILE_LINES)
+        return stream.getvalue()
+
+    def save(self, path):
+        self.profile.dump_stats(path)
+
+
+class SamplingProfiler:
+    """Сэмплирующий профилировщик pyinstrument, если он установлен."""
+    name = 'pyinstrument'
+    extension = 'html'
+
+    def __init__(self):
+        self.profiler = pyinstrument.Profiler()
+
+    def __enter__(self):
+        self.profiler.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.stop()
+
+    def text(self):
+        return self.profiler.output_text()
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.profiler.output_html())
+
+
+def is_staff(request):
+    """Проверяет сессию, а затем аутентификацию DRF (JWT)."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        user = Request(request, authenticators=[
+            authenticator() for authenticator
+            in api_settings.DEFAULT_AUTHENTICATION_CLASSES]).user
+    return user.is_authenticated and user.is_staff
+
+
+class ProfilingMiddleware:
+    """Профиль одного запроса по заголовку X-Profile или ?profile=.
+
+    Доступно только персоналу. Профиль и SQL-запросы с временем
+    сохраняются в PROFILING_DIR, имя файла возвращается в заголовке
+    X-Profile; старые отчёты сверх PROFILING_MAX_REPORTS удаляются.
+    Значение text заменяет ответ текстовым отчётом. Без флага
+    проверяются только заголовок и параметр запроса.
+
+    Под ASGI cProfile видит только код цикла событий, а не запросы ORM
+    в потоке sync_to_async; pyinstrument профилирует задачу целиком.
+    """
+    sync_capable = async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        mode = self.profile_mode(request)
+        if not mode or not self.allowed(request):
+            return self.get_response(request)
+
+        profiler = SamplingProfiler() if pyinstrument else CProfiler()
+        timer = QueryTimer(record=True)
+        start = time.perf_counter()
+        with timer, profiler:
+            response = self.get_response(request)
+        return self.finish(request, response, mode, profiler, timer, start)
+
+    async def __acall__(self, request):
+        mode = self.profile_mode(request)
+        if not mode or not await sync_to_async(self.allowed)(request):
+            return await self.get_response(request)
+
+        profiler = SamplingProfiler() if pyinstrument else CProfiler()
+        timer = QueryTimer(record=True)
+        start = time.perf_counter()
+        with profiler:
+            response = await atimed(timer, self.get_response, request)
+        return self.finish(request, response, mode, profiler, timer, start)
+
+    def allowed(self, request):
+        try:
+            return is_staff(request)
+        except APIException:
+            return False
+
+    def finish(self, request, response, mode, profiler, timer, start):
+        duration = time.perf_counter() - start
+        report = self.report(request, response, profiler, timer, duration)
+        name = self.save(request, profiler, report)
+        if mode == 'text':
+            response = HttpResponse(
+                report, content_type='text/plain; charset=utf-8')
+        response['X-Profile'] = name
+        return response
+
+    def profile_mode(self, request):
+        mode = request.META.get(PROFILE_HEADER)
+        if mode is None:
+            mode = request.GET.get(PROFILE_PARAM)
+        if mode is None or mode.lower() in ('', '0', 'false'):
+            return None
+        return mode.lower()
+
+    def report(self, request, response, profiler, timer, duration):
+        lines = [
+            f'{request.method} {request.get_full_path()} '
+            f'-> {response.status_code}',
+            f'Время: {duration * 1000:.1f} мс, профилировщик: '
+            f'{profiler.name}',
+            f'SQL: {timer.count} запросов, {timer.duration * 1000:.1f} мс',
+        ]
+        if timer.connection is not None:
+            source, setup_time = timer.connection
+            lines.append(f'Соединение с базой: {source}, установка '
+                         f'{setup_time * 1000:.1f} мс')
+        lines.append('')
+        for number, (elapsed, sql, params) in enumerate(timer.queries, 1):
+            lines.append(f'{number:3}. {elapsed * 1000:8.2f} мс  {sql}')
+            if params:
+                lines.append(f'     {params!r}')
+        lines.extend(['', profiler.text()])
+        return '\n'.join(lines)
+
+    def save(self, request, profiler, report):
+        os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+        route = route_label(request).replace(':', '.')
+        name = f'{datetime.now():%Y%m%d-%H%M%S-%f}-{route}'
+        with open(os.path.join(settings.PROFILING_DIR, f'{name}.txt'), 'w',
+                  encoding='utf-8') as file:
+            file.write(report)
+        profiler.save(os.path.join(
+            settings.PROFILING_DIR, f'{name}.{profiler.extension}'))
+        self.prune()
+        return name
+
+    def prune(self):
+        """Удаляет отчёты старше последних PROFILING_MAX_REPORTS.
+
+        Имена отчётов начинаются с времени, поэтому сортируются по нему.
+        """
+        reports = sorted(name[:-len('.txt')]
+                         for name in os.listdir(settings.PROFILING_DIR)
+                         if name.endswith('.txt'))
+        extensions = ('txt', CProfiler.extension, SamplingProfiler.extension)
+        for name in reports[:max(
+                len(reports) - settings.PROFILING_MAX_REPORTS, 0)]:
+            for extension in extensions:
+                with suppress(FileNotFoundError):
+                    os.remove(os.path.join(settings.PROFILING_DIR,
+                                           f'{name}.{extension}'))
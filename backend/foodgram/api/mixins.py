@@ -0,0 +1,240 @@
+from hashlib import md5
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import InvalidPage, Page
+from django.db.models import QuerySet
+from django.http import Http404
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+
+from recipes.versions import get_last_modified, get_version, get_versions
+from .paginators import FeedPagination
+
+
+class ConditionalGetMixin:
+    """ETag и Last-Modified для list/retrieve на основе версий данных.
+
+    ETag вычисляется из пути, параметров и версий etag_version_names без
+    обращения к базе, поэтому запрос с совпавшим If-None-Match получает
+    304 до выборки и сериализации. Если ответ зависит от пользователя,
+    get_etag_version_names должен вернуть его персональные версии.
+    """
+    etag_version_names = ()
+    conditional_actions = ('list', 'retrieve')
+
+    def get_etag_version_names(self, request):
+        return self.etag_version_names
+
+    def get_conditional_state(self, request):
+        """ETag и Last-Modified по версиям данных, без обращения к базе.
+
+        Версии читаются до выборки данных, а увеличиваются после фиксации
+        транзакции (bump_version), поэтому ответ может оказаться новее
+        своего ETag, но не старше: устаревший ETag не совпадёт с версией
+        и клиент получит данные заново.
+        """
+        names = self.get_etag_version_names(request)
+        versions = sorted(get_versions(*names).items())
+        params = sorted(request.query_params.lists())
+        etag = '"{}"'.format(md5(repr(
+            (request.path, params, versions)
+        ).encode()).hexdigest())
+        last_modified = get_last_modified(*names)
+        if last_modified is not None:
+            last_modified = int(last_modified)
+        return etag, last_modified
+
+    def set_conditional_headers(self, response, etag, last_modified):
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.conditional_actions:
+            return handler(request, *args, **kwargs)
+        etag, last_modified = self.get_conditional_state(request)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        return self.set_conditional_headers(response, etag, last_modified)
+
+    async def aconditional_response(self, handler, request, *args, **kwargs):
+        if self.action not in self.conditional_actions:
+            return await handler(request, *args, **kwargs)
+        etag, last_modified = await sync_to_async(
+            self.get_conditional_state)(request)
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+        return self.set_conditional_headers(response, etag, last_modified)
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            super().retrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.aconditional_response(
+            super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.aconditional_response(
+            super().aretrieve, request, *args, **kwargs)
+
+
+class AnonymousCacheMixin:
+    """Кеширует list/retrieve для анонимных пользователей.
+
+    Ключ строится из хоста, пути, параметров запроса и версии данных
+    cache_version_name, поэтому запись в базу инвалидирует все ответы
+    одним увеличением версии.
+    """
+    cache_version_name = 'recipes'
+
+    def get_response_cache_key(self, request):
+        params = urlencode(sorted(request.query_params.lists()), doseq=True)
+        url = f'{request.get_host()}{request.path}?{params}'
+        return 'response:{}:{}:{}'.format(
+            self.cache_version_name,
+            get_version(self.cache_version_name),
+            md5(url.encode()).hexdigest(),
+        )
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return handler(request, *args, **kwargs)
+        key = self.get_response_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            return Response(data)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        return response
+
+    async def acached_response(self, handler, request, *args, **kwargs):
+        if not request.user.is_anonymous:
+            return await handler(request, *args, **kwargs)
+        key = await sync_to_async(self.get_response_cache_key)(request)
+        data = await cache.aget(key)
+        if data is not None:
+            return Response(data)
+        response = await handler(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            await cache.aset(
+                key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(
+            super().alist, request, *args, **kwargs)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(
+            super().aretrieve, request, *args, **kwargs)
+
+
+class AsyncReadMixin:
+    """Асинхронные list/retrieve для ASGI (см. api.async_views).
+
+    Действия из async_actions выполняются корутинами a<действие> на
+    асинхронном ORM, с теми же фильтрами, пагинацией и сериализаторами,
+    что и синхронные. Аутентификация, права и проверка параметров
+    фильтра не имеют асинхронного API и выполняются через sync_to_async,
+    как и пагинация курсором. Сериализаторы не должны обращаться к базе:
+    всё нужное загружается выборкой вьюсета.
+    """
+    async_actions = ('list', 'retrieve')
+
+    async def adispatch(self, request, *args, **kwargs):
+        """APIView.dispatch для корутин a<действие>."""
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = getattr(self, f'a{self.action}')
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+        self.response = self.finalize_response(
+            request, response, *args, **kwargs)
+        return self.response
+
+    async def apaginate_queryset(self, queryset):
+        paginator = self.paginator
+        if paginator is None:
+            return None
+        if (not isinstance(paginator, PageNumberPagination)
+                or not isinstance(queryset, QuerySet)
+                or isinstance(paginator, FeedPagination)
+                and paginator.use_cursor(self.request)):
+            return await sync_to_async(self.paginate_queryset)(queryset)
+        page_size = paginator.get_page_size(self.request)
+        if not page_size:
+            return None
+        django_paginator = paginator.django_paginator_class(
+            queryset, page_size)
+        django_paginator.count = await queryset.acount()
+        page_number = paginator.get_page_number(
+            self.request, django_paginator)
+        try:
+            number = django_paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(paginator.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+        bottom = (number - 1) * page_size
+        objects = [obj async for obj in queryset[bottom:bottom + page_size]]
+        paginator.page = Page(objects, number, django_paginator)
+        paginator.request = self.request
+        return objects
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = await sync_to_async(self.filter_queryset)(
+            self.get_queryset())
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+        if isinstance(queryset, QuerySet):
+            queryset = [obj async for obj in queryset]
+        return Response(self.get_serializer(queryset, many=True).data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        queryset = await sync_to_async(self.filter_queryset)(
+            self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            instance = await queryset.aget(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        except (queryset.model.DoesNotExist, TypeError, ValueError):
+            raise Http404
+        self.check_object_permissions(request, instance)
+        return Response(self.get_serializer(instance).data)
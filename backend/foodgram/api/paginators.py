@@ -1,6 +1,55 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class PageLimitPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class LimitCursorPagination(CursorPagination):
+    page_size = 6
+    page_size_query_param = 'limit'
+    ordering = ('-pub_date', '-id')
+
+
+class FeedPagination(PageLimitPagination):
+    """Постраничная пагинация с опциональным режимом курсора.
+
+    По умолчанию работает как PageLimitPagination (page/limit).
+    Параметр ?pagination=cursor или ?cursor=... включает keyset-пагинацию
+    без COUNT(*) и OFFSET. Порядок курсора берётся из атрибута
+    cursor_ordering вьюсета. Курсор пересортировал бы выдачу, поэтому с
+    параметрами из ranked_query_params вьюсета (поиск по релевантности)
+    режим курсора отклоняется с ошибкой 400.
+    """
+    mode_query_param = 'pagination'
+    cursor_query_param = 'cursor'
+
+    cursor_paginator = None
+
+    def use_cursor(self, request):
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.use_cursor(request):
+            self.cursor_paginator = None
+            return super().paginate_queryset(queryset, request, view)
+        ranked = [param for param in getattr(view, 'ranked_query_params', ())
+                  if request.query_params.get(param)]
+        if ranked:
+            raise ValidationError({self.mode_query_param: (
+                'Режим курсора несовместим с сортировкой по релевантности: '
+                + ', '.join(ranked))})
+        self.cursor_paginator = LimitCursorPagination()
+        ordering = getattr(view, 'cursor_ordering', None)
+        if ordering:
+            self.cursor_paginator.ordering = ordering
+        return self.cursor_paginator.paginate_queryset(
+            queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
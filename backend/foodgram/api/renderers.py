@@ -0,0 +1,168 @@
+"""Форматы выгрузки списка покупок: ?format=txt|csv|json|pdf.
+
+Сам список отдаётся потоком через stream() или, под ASGI, astream(),
+render() нужен DRF только для ответов с ошибками.
+"""
+import csv
+import json
+import logging
+import os
+from abc import ABCMeta, abstractmethod
+from io import BytesIO, StringIO
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.renderers import JSONRenderer
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+def join_parts(parts):
+    """Следующие части итератора общим размером от CHUNK_SIZE.
+
+    Возвращает None, когда части кончились.
+    """
+    chunk, size = [], 0
+    for part in parts:
+        chunk.append(part)
+        size += len(part)
+        if size >= CHUNK_SIZE:
+            break
+    return chunk[0][:0].join(chunk) if chunk else None
+
+
+class ShoppingListRenderer(JSONRenderer, metaclass=ABCMeta):
+    extension = None
+
+    @property
+    def content_type(self):
+        if self.charset:
+            return f'{self.media_type}; charset={self.charset}'
+        return self.media_type
+
+    @abstractmethod
+    def stream(self, user, shopping_list, today):
+        """Части файла: строки или байты."""
+
+    async def astream(self, user, shopping_list, today):
+        """stream() для ASGI.
+
+        Синхронный итератор Django под ASGI сначала читает целиком. Здесь
+        части собираются в потоке пачками примерно по CHUNK_SIZE и
+        отдаются по мере готовности, не занимая цикл событий.
+        """
+        parts = iter(self.stream(user, shopping_list, today))
+        next_chunk = sync_to_async(join_parts, thread_sensitive=False)
+        while (chunk := await next_chunk(parts)) is not None:
+            yield chunk
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+    charset = 'utf-8'
+    extension = 'txt'
+
+    def stream(self, user, shopping_list, today):
+        yield (f'Список покупок для: {user.get_full_name()}\n\n'
+               f'Дата: {today:%Y-%m-%d}\n\n')
+        separator = ''
+        for name, unit, amount in shopping_list:
+            yield f'{separator}- {name} ({unit}) - {amount}'
+            separator = '\n'
+        yield f'\n\nFoodgram ({today:%Y})'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+    extension = 'csv'
+
+    def stream(self, user, shopping_list, today):
+        buffer = StringIO()
+        writer = csv.writer(buffer)
+        for row in (('name', 'measurement_unit', 'amount'),
+                    *shopping_list):
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    format = 'json'
+    extension = 'json'
+
+    def stream(self, user, shopping_list, today):
+        user_name = json.dumps(user.get_full_name(), ensure_ascii=False)
+        yield (f'{{"user": {user_name}, "date": "{today:%Y-%m-%d}", '
+               f'"ingredients": [')
+        separator = ''
+        for name, unit, amount in shopping_list:
+            yield separator + json.dumps({
+                'name': name,
+                'measurement_unit': unit,
+                'amount': amount,
+            }, ensure_ascii=False)
+            separator = ', '
+        yield ']}'
+
+
+class ShoppingListPDFRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    extension = 'pdf'
+    font_name = 'ShoppingListFont'
+
+    def get_font(self):
+        font_path = settings.SHOPPING_LIST_FONT
+        if not os.path.exists(font_path):
+            # В Helvetica нет кириллицы: названия выйдут пустыми.
+            logger.warning('Шрифт для списка покупок не найден: %s. '
+                           'Используется Helvetica без кириллицы.', font_path)
+            return 'Helvetica'
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(self.font_name, font_path))
+        return self.font_name
+
+    def stream(self, user, shopping_list, today):
+        # PDF собирается целиком: таблица ссылок на объекты пишется в
+        # конце файла. Готовый документ отдаётся частями.
+        buffer = BytesIO()
+        font = self.get_font()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        width, height = A4
+        lines = [f'Список покупок для: {user.get_full_name()}',
+                 f'Дата: {today:%Y-%m-%d}', '']
+        lines += [f'- {name} ({unit}) - {amount}'
+                  for name, unit, amount in shopping_list]
+        lines += ['', f'Foodgram ({today:%Y})']
+        text = pdf.beginText(50, height - 50)
+        text.setFont(font, 12)
+        for line in lines:
+            if text.getY() < 50:
+                pdf.drawText(text)
+                pdf.showPage()
+                text = pdf.beginText(50, height - 50)
+                text.setFont(font, 12)
+            text.textLine(line)
+        pdf.drawText(text)
+        pdf.save()
+        buffer.seek(0)
+        while chunk := buffer.read(CHUNK_SIZE):
+            yield chunk
+
+
+SHOPPING_LIST_RENDERERS = (
+    ShoppingListTextRenderer,
+    ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer,
+    ShoppingListPDFRenderer,
+)
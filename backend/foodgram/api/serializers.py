@@ -1,25 +1,111 @@
 import base64
+import binascii
+from tempfile import SpooledTemporaryFile
 
+from django.conf import settings
 from django.contrib.auth import password_validation as validators
-from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from PIL import Image, UnidentifiedImageError
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from rest_framework.generics import get_object_or_404
 
+from recipes.images import image_srcset
 from recipes.models import (FavoriteRecipe, Follow, Ingredient,
-                            IngredientAmount, Recipe, ShoppingCart, Tag, User)
+                            IngredientAmount, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag, User)
+from recipes.relations import delete_rows
+from recipes.versions import bump_version
+
+
+# Символов base64 за одно декодирование, кратно 4.
+BASE64_CHUNK_SIZE = 64 * 1024
+# Длина заголовка data URI ограничена, чтобы не искать запятую во всей
+# строке.
+DATA_URI_HEADER_LENGTH = 100
 
 
 class Base64ImageField(serializers.ImageField):
+    """Картинка из data URI с потоковым декодированием base64.
+
+    Строка декодируется частями во временный файл, который до
+    FILE_UPLOAD_MAX_MEMORY_SIZE держится в памяти, а дальше уходит на
+    диск. Размер файла проверяется до декодирования, размеры картинки -
+    по заголовку, до распаковки пикселей.
+    """
+    default_error_messages = {
+        'data_uri': 'Ожидается картинка вида data:image/...;base64,...',
+        'base64': 'Некорректные данные base64.',
+        'file_size': 'Картинка больше {max_size} МБ.',
+        'pixels': 'Картинка больше {max_pixels} мегапикселей.',
+    }
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-
+            return self.decode_data_uri(data)
         return super().to_internal_value(data)
 
+    def fail_file_size(self):
+        self.fail('file_size',
+                  max_size=f'{settings.MAX_IMAGE_UPLOAD_SIZE / 1024 ** 2:g}')
+
+    def fail_pixels(self):
+        self.fail('pixels',
+                  max_pixels=f'{settings.MAX_IMAGE_PIXELS / 10 ** 6:g}')
+
+    def decode_data_uri(self, data):
+        start = data.find(',', 0, DATA_URI_HEADER_LENGTH) + 1
+        if not start or not data[:start].endswith(';base64,'):
+            self.fail('data_uri')
+        if (len(data) - start) * 3 // 4 > settings.MAX_IMAGE_UPLOAD_SIZE:
+            self.fail_file_size()
+        file = SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+        rest = ''
+        try:
+            for position in range(start, len(data), BASE64_CHUNK_SIZE):
+                # Переносы строк допустимы, поэтому хвост, не кратный 4,
+                # переходит в следующую часть.
+                chunk = rest + ''.join(
+                    data[position:position + BASE64_CHUNK_SIZE].split())
+                end = len(chunk) - len(chunk) % 4
+                file.write(base64.b64decode(chunk[:end], validate=True))
+                rest = chunk[end:]
+        except binascii.Error:
+            file.close()
+            self.fail('base64')
+        size = file.tell()
+        if rest:
+            file.close()
+            self.fail('base64')
+        if not size:
+            file.close()
+            self.fail('empty')
+        file.seek(0)
+        return UploadedFile(file, name=f'temp.{self.check_image(file)}',
+                            size=size)
+
+    def check_image(self, file):
+        """Проверяет картинку без распаковки пикселей, возвращает формат."""
+        try:
+            # Image.open читает только заголовок.
+            image = Image.open(file)
+            width, height = image.size
+            if width * height > settings.MAX_IMAGE_PIXELS:
+                self.fail_pixels()
+            image.verify()
+        except Image.DecompressionBombError:
+            file.close()
+            self.fail_pixels()
+        except ValidationError:
+            file.close()
+            raise
+        except (UnidentifiedImageError, OSError, SyntaxError, ValueError):
+            file.close()
+            self.fail('invalid_image')
+        file.seek(0)
+        return image.format.lower()
+
 
 class UserCreateSerializer(serializers.ModelSerializer):
 
@@ -60,6 +146,8 @@ class UserGetSerializer(serializers.ModelSerializer):
             return False
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return Follow.objects.filter(user=user, following=obj).exists()
 
 
@@ -72,15 +160,19 @@ class FollowSerializer(UserGetSerializer):
             'recipes', 'recipes_count']
 
     def get_recipes(self, obj):
-        recipes_limit = self.context.get('recipes_limit')
-        recipes = Recipe.objects.filter(author=obj)
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+        author_recipes = self.context.get('author_recipes')
+        if author_recipes is not None:
+            recipes = author_recipes.get(obj.pk, [])
+        else:
+            recipes_limit = self.context.get('recipes_limit')
+            recipes = Recipe.objects.filter(author=obj)
+            if recipes_limit:
+                recipes = recipes[:int(recipes_limit)]
         serializer = RecipeFollowSerializer(recipes, many=True, read_only=True)
         return serializer.data
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
+        return obj.recipes_count
 
 
 class SetPasswordSerializer(serializers.Serializer):
@@ -148,22 +240,18 @@ class RecipePostSerializer(serializers.ModelSerializer):
             raise ValidationError({
                 'ingredients': 'Ингредиенты отсутствуют!'
             })
-        ingredients_list = []
-        for instance in ingredients:
-            if not Ingredient.objects.filter(id=instance['id']).exists():
-                raise ValidationError({
-                    'ingredients': 'В списке несуществующие ингредиенты!'})
-            ingredient = get_object_or_404(Ingredient,
-                                           id=instance['id'])
-            if ingredient in ingredients_list:
-                raise ValidationError({
-                    'ingredients': 'В списке одинаковые ингредиенты!'
-                })
-            if int(instance['amount']) <= 0:
-                raise ValidationError({
-                    'amount': 'Количество должно быть больше 0!'
-                })
-            ingredients_list.append(ingredient)
+        ids = [instance['id'] for instance in ingredients]
+        if len(Ingredient.objects.in_bulk(ids)) != len(set(ids)):
+            raise ValidationError({
+                'ingredients': 'В списке несуществующие ингредиенты!'})
+        if len(set(ids)) != len(ids):
+            raise ValidationError({
+                'ingredients': 'В списке одинаковые ингредиенты!'
+            })
+        if any(int(instance['amount']) <= 0 for instance in ingredients):
+            raise ValidationError({
+                'amount': 'Количество должно быть больше 0!'
+            })
         return value
 
     def validate_tags(self, value):
@@ -178,39 +266,74 @@ class RecipePostSerializer(serializers.ModelSerializer):
             tags_list.append(tag)
         return value
 
+    def save_ingredients(self, recipe, ingredients, current=()):
+        """Записывает только изменившиеся ингредиенты рецепта.
+
+        Новые строки добавляются одним bulk_create, изменённые количества -
+        одним bulk_update, исчезнувшие из списка - одним DELETE. Массовые
+        операции не отправляют сигналы, поэтому списки покупок с этим
+        рецептом сдвигаются на разницу количеств здесь.
+        """
+        amounts = {instance['id']: instance['amount']
+                   for instance in ingredients}
+        current = {row.ingredient_id: row for row in current}
+        removed = [row for ingredient_id, row in current.items()
+                   if ingredient_id not in amounts]
+        changed, changes = [], {}
+        for ingredient_id, row in current.items():
+            if (ingredient_id in amounts
+                    and row.amount != amounts[ingredient_id]):
+                changes[recipe.pk, ingredient_id] = (
+                    amounts[ingredient_id] - row.amount)
+                row.amount = amounts[ingredient_id]
+                changed.append(row)
+        added = [IngredientAmount(ingredient_id=ingredient_id,
+                                  amount=amount, recipe=recipe)
+                 for ingredient_id, amount in amounts.items()
+                 if ingredient_id not in current]
+        if removed:
+            # Без сигналов post_delete: каждый из них обновлял бы
+            # списки покупок отдельно.
+            for ingredient_id, amount in delete_rows(
+                    IngredientAmount, ['ingredient', 'amount'],
+                    id=[row.pk for row in removed]):
+                changes[recipe.pk, ingredient_id] = -amount
+        if changed:
+            IngredientAmount.objects.bulk_update(changed, ['amount'])
+        if added:
+            IngredientAmount.objects.bulk_create(added)
+            changes.update(((recipe.pk, row.ingredient_id), row.amount)
+                           for row in added)
+        if removed or changed or added:
+            bump_version('recipes')
+        if current:
+            ShoppingListItem.objects.recipes_changed(changes)
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe_to_save = super().create(validated_data)
         recipe_to_save.tags.set(tags)
-        for ingredient_to_save in ingredients:
-            IngredientAmount(
-                ingredient_id=ingredient_to_save.get('id'),
-                amount=ingredient_to_save.get('amount'),
-                recipe=recipe_to_save,).save()
+        self.save_ingredients(recipe_to_save, ingredients)
         return recipe_to_save
 
+    @transaction.atomic
     def update(self, recipe, validated_data):
-        if 'ingredients' in validated_data:
-            ingredients = validated_data.pop('ingredients')
-            recipe.ingredients.clear()
-            for ingredient_to_save in ingredients:
-                IngredientAmount(
-                    ingredient_id=ingredient_to_save.get('id'),
-                    amount=ingredient_to_save.get('amount'),
-                    recipe=recipe,).save()
-        else:
+        if 'ingredients' not in validated_data:
             raise ValidationError({'ingredients': 'Нет поля ингредиентов!'})
-        if 'tags' in validated_data:
-            recipe.tags.set(validated_data.pop('tags'))
-        else:
+        if 'tags' not in validated_data:
             raise ValidationError({'tags': 'Нет поля тегов!'})
+        self.save_ingredients(recipe, validated_data.pop('ingredients'),
+                              recipe.ingredientamount_set.all())
+        recipe.tags.set(validated_data.pop('tags'))
         return super().update(
             recipe, validated_data)
 
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
+        instance = Recipe.objects.for_read(request.user).get(pk=instance.pk)
         return RecipeSerializer(instance, context=context).data
 
 
@@ -222,29 +345,56 @@ class RecipeSerializer(serializers.ModelSerializer):
                                              source='ingredientamount_set')
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    image_srcset = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
-        fields = ['id', 'tags', 'image', 'author', 'ingredients',
-                  'is_favorited', 'is_in_shopping_cart', 'name',
-                  'image', 'text', 'cooking_time']
+        fields = ['id', 'tags', 'image', 'image_srcset', 'author',
+                  'ingredients', 'is_favorited', 'is_in_shopping_cart',
+                  'name', 'text', 'cooking_time']
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj, self.context.get('request'))
 
     def get_is_favorited(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return FavoriteRecipe.objects.filter(user=user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return ShoppingCart.objects.filter(user=user, recipe=obj).exists()
 
 
 class RecipeFollowSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    image_srcset = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
-        fields = ['id', 'name', 'image', 'cooking_time']
+        fields = ['id', 'name', 'image', 'image_srcset', 'cooking_time']
+
+    def get_image_srcset(self, obj):
+        return image_srcset(obj, self.context.get('request'))
+
+
+class RelationBatchSerializer(serializers.Serializer):
+    add = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), default=list,
+        max_length=settings.RELATION_BATCH_SIZE)
+    remove = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), default=list,
+        max_length=settings.RELATION_BATCH_SIZE)
+
+    def validate(self, data):
+        if set(data['add']) & set(data['remove']):
+            raise ValidationError(
+                'Один и тот же id не может быть в add и remove!')
+        return data
@@ -0,0 +1,685 @@
+import base64
+import os
+import re
+import shutil
+import tempfile
+from collections import Counter, namedtuple
+from datetime import datetime
+from unittest.mock import patch
+
+from api.metrics import action_label
+from api.renderers import SHOPPING_LIST_RENDERERS, ShoppingListPDFRenderer
+from api.serializers import Base64ImageField
+from api.views import (IngredientViewSet, RecipeViewSet, TagViewSet,
+                       TokenLoginViewSet, UserViewSet)
+from asgiref.sync import async_to_sync
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from recipes.images import image_data
+from recipes.models import (FavoriteRecipe, Follow, Ingredient,
+                            IngredientAmount, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag, User)
+from recipes.shopping_list import get_shopping_list
+from reportlab import rl_config
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+
+MEDIA_ROOT = tempfile.mkdtemp()
+PASSWORD = 'Budget-password-1'
+LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+\b")
+PLACEHOLDER_LISTS = re.compile(r'\((?:\s*(?:%s|\?)\s*,)+\s*(?:%s|\?)\s*\)')
+
+Case = namedtuple('Case', 'name method url data', defaults=(None,))
+
+
+def create_user(username, **fields):
+    """Пользователь с заполненными обязательными полями."""
+    fields = {'email': f'{username}@x.ru', 'first_name': 'Имя',
+              'last_name': 'Фамилия', **fields}
+    return User.objects.create(username=username, **fields)
+
+
+def create_recipe(author, name='Рецепт', **fields):
+    """Рецепт без ингредиентов и тегов."""
+    fields = {'text': 'Описание рецепта.', 'image': 'recipes/recipe.png',
+              'cooking_time': 10, **fields}
+    return Recipe.objects.create(author=author, name=name, **fields)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class RecipeIngredientsQueriesTests(APITestCase):
+    """Число запросов на запись рецепта не зависит от числа ингредиентов."""
+    sizes = (2, 10, 40)
+    create_queries = 15
+    update_queries = 22
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.buyers = [create_user(f'buyer-{number}') for number in range(3)]
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', color='#FFFFFF',
+                               slug=f'tag-{number}')
+            for number in range(2)]
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(max(cls.sizes) * 2))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client.force_authenticate(self.author)
+
+    def recipe_data(self, ingredients, amount):
+        return {
+            'ingredients': [{'id': ingredient.pk, 'amount': amount}
+                            for ingredient in ingredients],
+            'tags': [tag.pk for tag in self.tags],
+            'image': image_data(),
+            'name': 'Рецепт',
+            'text': 'Описание рецепта.',
+            'cooking_time': 10,
+        }
+
+    def create_recipe(self, ingredients):
+        recipe = create_recipe(self.author)
+        recipe.tags.set(self.tags)
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredient=ingredient, amount=10)
+            for ingredient in ingredients)
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=buyer, recipe=recipe) for buyer in self.buyers)
+        ShoppingListItem.objects.refresh(self.buyers)
+        return recipe
+
+    def test_create(self):
+        for size in self.sizes:
+            with self.subTest(ingredients=size):
+                ingredients = self.ingredients[:size]
+                with self.assertNumQueries(self.create_queries):
+                    response = self.client.post(
+                        '/api/recipes/', self.recipe_data(ingredients, 5),
+                        format='json')
+                self.assertEqual(response.status_code,
+                                 status.HTTP_201_CREATED)
+                self.assertEqual(len(response.data['ingredients']), size)
+
+    def test_update(self):
+        for size in self.sizes:
+            with self.subTest(ingredients=size):
+                recipe = self.create_recipe(self.ingredients[:size])
+                # Половина ингредиентов остаётся с новым количеством,
+                # остальные заменяются новыми.
+                ingredients = self.ingredients[size // 2:size + size // 2]
+                with self.assertNumQueries(self.update_queries):
+                    response = self.client.patch(
+                        f'/api/recipes/{recipe.pk}/',
+                        self.recipe_data(ingredients, 7), format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(
+                    dict(recipe.ingredientamount_set.values_list(
+                        'ingredient', 'amount')),
+                    {ingredient.pk: 7 for ingredient in ingredients})
+                self.assertEqual(
+                    ShoppingListItem.objects.actual(self.buyers),
+                    dict(((user, ingredient), amount)
+                         for user, ingredient, amount
+                         in ShoppingListItem.objects.filter(
+                             user__in=self.buyers).values_list(
+                             'user', 'ingredient', 'amount')))
+                recipe.delete()
+
+
+class RecipeSearchTests(APITestCase):
+    """Выдача поиска по релевантности в обоих режимах пагинации."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        # Совпадение в названии весомее совпадения в описании, хотя
+        # рецепт с совпадением в описании новее.
+        create_recipe(cls.user, 'суп')
+        create_recipe(cls.user, 'борщ', text='почти суп')
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_rank_order(self):
+        response = self.client.get('/api/recipes/?search=суп')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([recipe['name'] for recipe in response.data[
+            'results']], ['суп', 'борщ'])
+        for params in ('pagination=cursor', 'cursor=abc'):
+            with self.subTest(params):
+                response = self.client.get(
+                    f'/api/recipes/?search=суп&{params}')
+                self.assertEqual(response.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+        response = self.client.get('/api/recipes/?pagination=cursor')
+        self.assertEqual([recipe['name'] for recipe in response.data[
+            'results']], ['борщ', 'суп'])
+
+
+class Base64ImageFieldTests(APITestCase):
+    """Ограничения картинки из data URI и тексты ошибок."""
+
+    def assertRejected(self, data, code, message=None):
+        with self.assertRaises(ValidationError) as context:
+            Base64ImageField().to_internal_value(data)
+        self.assertEqual(context.exception.get_codes(), [code])
+        if message is not None:
+            self.assertEqual(context.exception.detail, [message])
+
+    def test_valid(self):
+        self.assertEqual(
+            Base64ImageField().to_internal_value(image_data()).name,
+            'temp.png')
+
+    def test_invalid_data(self):
+        data = image_data()
+        svg = base64.b64encode(
+            b'<svg xmlns="http://www.w3.org/2000/svg"/>').decode()
+        cases = [
+            ('data:image/png,abcd', 'data_uri'),
+            ('data:image/png;base64,ab$d', 'base64'),
+            # Обрезанная строка: хвост не кратен 4 символам.
+            (data[:-3], 'base64'),
+            # Обрезанный файл: base64 корректен, картинка - нет.
+            (data[:-8], 'invalid_image'),
+            ('data:image/png;base64,', 'empty'),
+            (f'data:image/svg+xml;base64,{svg}', 'invalid_image'),
+        ]
+        for data, code in cases:
+            with self.subTest(code, data=data[:40]):
+                self.assertRejected(data, code)
+
+    @override_settings(MAX_IMAGE_UPLOAD_SIZE=512 * 1024)
+    def test_file_size(self):
+        self.assertRejected('data:image/png;base64,' + 'A' * 700 * 1024,
+                            'file_size', 'Картинка больше 0.5 МБ.')
+
+    @override_settings(MAX_IMAGE_PIXELS=500 * 1000)
+    def test_pixels(self):
+        self.assertRejected(image_data(Image.new('RGB', (1000, 1000))),
+                            'pixels', 'Картинка больше 0.5 мегапикселей.')
+
+
+class RelationBatchTests(APITestCase):
+    """Статусы и счётчики пакетного избранного по затронутым строкам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.recipes = [create_recipe(cls.user, f'Рецепт {number}')
+                       for number in range(3)]
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def test_favorite_batch(self):
+        first, second, third = (recipe.pk for recipe in self.recipes)
+        FavoriteRecipe.objects.create(user=self.user, recipe_id=first)
+        missing = third + 1000
+        response = self.client.post('/api/recipes/favorite/batch/', {
+            'add': [first, second, missing], 'remove': [third]},
+            format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {
+            'add': {first: 'exists', second: 'added', missing: 'not_found'},
+            'remove': {third: 'missing'},
+        })
+        response = self.client.post('/api/recipes/favorite/batch/', {
+            'remove': [first, second]}, format='json')
+        self.assertEqual(response.data['remove'],
+                         {first: 'removed', second: 'removed'})
+        self.assertFalse(FavoriteRecipe.objects.exists())
+        self.assertEqual(
+            list(Recipe.objects.values_list('favorites_count', flat=True)),
+            [0, 0, 0])
+
+
+class ShoppingListDeltasTests(APITestCase):
+    """Списки покупок сдвигаются на разницу и совпадают с пересчётом."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('user')
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(3))
+        cls.recipes = [create_recipe(cls.user, f'Рецепт {number}')
+                       for number in range(2)]
+        for recipe in cls.recipes:
+            IngredientAmount.objects.bulk_create(
+                IngredientAmount(recipe=recipe, ingredient=ingredient,
+                                 amount=10)
+                for ingredient in cls.ingredients[:2])
+
+    def setUp(self):
+        self.client.force_authenticate(self.user)
+
+    def assertListActual(self):
+        self.assertEqual(
+            ShoppingListItem.objects.actual([self.user]),
+            dict(((user, ingredient), amount)
+                 for user, ingredient, amount
+                 in ShoppingListItem.objects.values_list(
+                     'user', 'ingredient', 'amount')))
+
+    def test_deltas(self):
+        first, second = self.recipes
+        for recipe in self.recipes:
+            self.client.post(f'/api/recipes/{recipe.pk}/shopping_cart/')
+        self.assertListActual()
+        row = first.ingredientamount_set.get(
+            ingredient=self.ingredients[0])
+        row.ingredient = self.ingredients[2]
+        row.amount = 5
+        row.save()
+        self.assertListActual()
+        second.ingredientamount_set.get(
+            ingredient=self.ingredients[1]).delete()
+        self.assertListActual()
+        self.client.delete(f'/api/recipes/{second.pk}/shopping_cart/')
+        self.assertListActual()
+        self.client.delete(f'/api/recipes/{first.pk}/')
+        self.assertListActual()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_drift_logged(self):
+        ingredient = self.ingredients[0].pk
+        ShoppingListItem.objects.apply_deltas({(self.user.pk, ingredient): 5})
+        with self.assertLogs('recipes.models', 'WARNING') as logs:
+            ShoppingListItem.objects.apply_deltas(
+                {(self.user.pk, ingredient): -8})
+        self.assertIn(f'({self.user.pk}, {ingredient}, -3)', logs.output[0])
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_cache(self):
+        cache.clear()
+        first, second = self.recipes
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/recipes/{first.pk}/shopping_cart/')
+        cached = get_shopping_list(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(f'/api/recipes/{second.pk}/',
+                              {'name': 'Другой рецепт'}, format='json')
+        with self.assertNumQueries(0):
+            self.assertEqual(get_shopping_list(self.user), cached)
+        with self.captureOnCommitCallbacks(execute=True):
+            ingredient = self.ingredients[0]
+            ingredient.name = 'Переименованный'
+            ingredient.save()
+        self.assertIn(('Переименованный', 'г', 10),
+                      get_shopping_list(self.user))
+        with self.captureOnCommitCallbacks(execute=True):
+            first.ingredientamount_set.filter(
+                ingredient=self.ingredients[1]).update(amount=20)
+            ShoppingListItem.objects.recipes_changed(
+                {(first.pk, self.ingredients[1].pk): 10})
+        self.assertIn(('Ингредиент 1', 'г', 20),
+                      get_shopping_list(self.user))
+
+
+def duplicated(queries):
+    """Повторяющиеся шаблоны запросов - типичный след N+1.
+
+    Литералы и списки IN (...) в шаблоне заменены на «?».
+    """
+    counts = Counter(
+        PLACEHOLDER_LISTS.sub('(...)', LITERALS.sub('?', query['sql']))
+        for query in queries)
+    return [f'x{count}: {sql}' for sql, count in counts.most_common()
+            if count > 1]
+
+
+class Dataset:
+    """Данные, которые растут до заданного числа авторов.
+
+    Пользователь подписан на всех авторов, а их рецепты у него в
+    избранном и в списке покупок. Авторы, в свою очередь, добавляют в
+    избранное и в списки покупок рецепт пользователя. Так вместе с
+    числом авторов растут и ответы, и каскады при удалении.
+    """
+    recipes_per_author = 2
+    ingredients_per_recipe = 3
+
+    def __init__(self):
+        password = make_password(PASSWORD)
+        self.user, self.stranger = (
+            create_user(name, password=password)
+            for name in ('user', 'stranger'))
+        self.tags = [
+            Tag.objects.create(name=f'Тег {number}', color='#FFFFFF',
+                               slug=f'tag-{number}')
+            for number in range(2)]
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(self.ingredients_per_recipe * 4)]
+        self.authors, self.recipes = [], []
+        self.own_recipe = self.create_recipe(self.user)
+
+    def create_recipe(self, author):
+        number = Recipe.objects.filter(author=author).count()
+        recipe = create_recipe(author, f'Рецепт {author.pk} {number}')
+        recipe.tags.set(self.tags)
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(recipe=recipe, ingredient=ingredient,
+                             amount=10 + number)
+            for ingredient in self.ingredients[
+                number:number + self.ingredients_per_recipe])
+        return recipe
+
+    def grow(self, authors):
+        while len(self.authors) < authors:
+            author = create_user(f'author-{len(self.authors)}',
+                                 password=self.user.password)
+            Follow.objects.create(user=self.user, following=author)
+            FavoriteRecipe.objects.create(user=author, recipe=self.own_recipe)
+            ShoppingCart.objects.create(user=author, recipe=self.own_recipe)
+            for _ in range(self.recipes_per_author):
+                recipe = self.create_recipe(author)
+                FavoriteRecipe.objects.create(user=self.user, recipe=recipe)
+                ShoppingCart.objects.create(user=self.user, recipe=recipe)
+                self.recipes.append(recipe)
+            self.authors.append(author)
+
+    def cases(self):
+        recipe, own = self.recipes[0].pk, self.own_recipe.pk
+        author = self.authors[0].pk
+        recipes = [recipe.pk for recipe in self.recipes]
+        authors = [author.pk for author in self.authors]
+        tags = '&'.join(f'tags={tag.slug}' for tag in self.tags)
+        recipe_data = {
+            'ingredients': [{'id': ingredient.pk, 'amount': 5}
+                            for ingredient in self.ingredients[-4:]],
+            'tags': [tag.pk for tag in self.tags],
+            'image': image_data(),
+            'name': 'Новый рецепт',
+            'text': 'Описание нового рецепта.',
+            'cooking_time': 15,
+        }
+        return [
+            Case('recipes_list', 'get', '/api/recipes/'),
+            Case('recipes_list_tags', 'get', f'/api/recipes/?{tags}'),
+            Case('recipes_list_favorited', 'get',
+                 '/api/recipes/?is_favorited=1'),
+            Case('recipes_list_cart', 'get',
+                 '/api/recipes/?is_in_shopping_cart=1'),
+            Case('recipes_list_author', 'get',
+                 f'/api/recipes/?author={author}'),
+            Case('recipes_list_cursor', 'get',
+                 '/api/recipes/?pagination=cursor&limit=100'),
+            Case('recipes_list_all', 'get', '/api/recipes/?limit=100'),
+            Case('recipe_detail', 'get', f'/api/recipes/{recipe}/'),
+            Case('recipe_create', 'post', '/api/recipes/', recipe_data),
+            Case('recipe_update', 'patch', f'/api/recipes/{own}/',
+                 recipe_data),
+            Case('recipe_delete', 'delete', f'/api/recipes/{own}/'),
+            Case('favorite_add', 'post', f'/api/recipes/{own}/favorite/'),
+            Case('favorite_remove', 'delete',
+                 f'/api/recipes/{recipe}/favorite/'),
+            Case('favorite_batch', 'post', '/api/recipes/favorite/batch/',
+                 {'add': [own], 'remove': recipes}),
+            Case('shopping_cart_add', 'post',
+                 f'/api/recipes/{own}/shopping_cart/'),
+            Case('shopping_cart_remove', 'delete',
+                 f'/api/recipes/{recipe}/shopping_cart/'),
+            Case('shopping_cart_batch', 'post',
+                 '/api/recipes/shopping_cart/batch/',
+                 {'add': [own], 'remove': recipes}),
+            Case('shopping_cart_download', 'get',
+                 '/api/recipes/download_shopping_cart/'),
+            Case('users_list', 'get', '/api/users/?limit=100'),
+            Case('user_detail', 'get', f'/api/users/{author}/'),
+            Case('users_me', 'get', '/api/users/me/'),
+            Case('user_create', 'post', '/api/users/', {
+                'email': 'new@x.ru', 'username': 'new',
+                'first_name': 'Имя', 'last_name': 'Фамилия',
+                'password': PASSWORD}),
+            Case('set_password', 'post', '/api/users/set_password/', {
+                'current_password': PASSWORD, 'new_password': PASSWORD}),
+            Case('subscriptions', 'get',
+                 '/api/users/subscriptions/?limit=100&recipes_limit=1'),
+            Case('subscribe', 'post',
+                 f'/api/users/{self.stranger.pk}/subscribe/'),
+            Case('unsubscribe', 'delete', f'/api/users/{author}/subscribe/'),
+            Case('subscribe_batch', 'post', '/api/users/subscribe/batch/',
+                 {'add': [self.stranger.pk], 'remove': authors}),
+            Case('tags_list', 'get', '/api/tags/'),
+            Case('tag_detail', 'get', f'/api/tags/{self.tags[0].pk}/'),
+            Case('ingredients_list', 'get',
+                 '/api/ingredients/?name=Ингредиент'),
+            Case('ingredient_detail', 'get',
+                 f'/api/ingredients/{self.ingredients[0].pk}/'),
+            Case('token_login', 'post', '/api/auth/token/login/', {
+                'email': self.user.email, 'password': PASSWORD}),
+        ]
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class QueryBudgetsTests(APITestCase):
+    """Бюджеты SQL-запросов на действия вьюсетов.
+
+    Бюджет объявлен на действие ('RecipeViewSet.list'), действие
+    определяется по маршруту ответа. Каждый запрос выполняется на двух
+    объёмах данных: число запросов не должно превышать бюджет действия
+    и не должно расти вместе с данными. Запросы аутентификации в бюджет
+    не входят: клиент аутентифицирован принудительно. Кэш очищается
+    перед каждым запросом, поэтому считаются запросы без попаданий в
+    кэш.
+    """
+    sizes = (2, 10)
+    budgets = {
+        # Ответ с рецептами: выборка строк и prefetch тегов, ингредиентов
+        # и авторов - 4 запроса, у страницы со смещением ещё COUNT(*).
+        # Фильтр по тегам или автору добавляет выборку значения фильтра.
+        'RecipeViewSet.list': 6,
+        'RecipeViewSet.retrieve': 4,
+        # Проверка ингредиентов и двух тегов, точка сохранения, рецепт,
+        # счётчик автора, теги (3), ингредиенты и ответ.
+        'RecipeViewSet.create': 15,
+        # Рецепт с автором, проверка, точка сохранения, ингредиенты
+        # (выборка, DELETE, UPDATE, INSERT), списки покупок (5), теги,
+        # рецепт и ответ.
+        'RecipeViewSet.partial_update': 22,
+        # Рецепт с автором, точка сохранения, избранное и корзины со
+        # счётчиками, списки покупок (4), ингредиенты, каскад Django
+        # (3 выборки, теги, рецепт) и счётчик автора.
+        'RecipeViewSet.destroy': 19,
+        # Смена связи: INSERT или DELETE ... RETURNING и счётчик через F(),
+        # у списка покупок ещё выборка ингредиентов рецептов и сдвиг строк
+        # списков (вставка нулевых, выборка и удаление обнуляющихся,
+        # UPDATE). Запись внутри transaction.atomic - ещё SAVEPOINT и
+        # RELEASE.
+        'RecipeViewSet.favorite': 5,
+        # Выборка существующих рецептов, INSERT, DELETE и два счётчика.
+        'RecipeViewSet.favorite_batch': 7,
+        'RecipeViewSet.shopping_cart': 8,
+        'RecipeViewSet.shopping_cart_batch': 11,
+        # Список покупок одним запросом.
+        'RecipeViewSet.download_shopping_cart': 1,
+        'UserViewSet.list': 2,
+        'UserViewSet.retrieve': 1,
+        'UserViewSet.get_me_data': 0,
+        # Проверка уникальности email и имени, INSERT.
+        'UserViewSet.create': 3,
+        'UserViewSet.set_password': 1,
+        # COUNT(*), авторы и их последние рецепты одним запросом.
+        'UserViewSet.subscriptions': 3,
+        # Автор, точка сохранения, INSERT и ответ с рецептами автора.
+        'UserViewSet.subscribe': 6,
+        'UserViewSet.subscribe_batch': 5,
+        'TagViewSet.list': 1,
+        'TagViewSet.retrieve': 1,
+        'IngredientViewSet.list': 1,
+        'IngredientViewSet.retrieve': 1,
+        # Пользователь и токен.
+        'TokenLoginViewSet.post': 2,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        dataset = Dataset()
+        client = cls.client_class()
+        client.force_authenticate(dataset.user)
+        # {действие: {проверка: [число запросов на каждом объёме]}}
+        cls.counts, cls.captured = {}, {}
+        for size in cls.sizes:
+            dataset.grow(size)
+            for case in dataset.cases():
+                label, queries = cls.measure(client, case)
+                cls.counts.setdefault(label, {}).setdefault(
+                    case.name, []).append(len(queries))
+                cls.captured[case.name] = queries
+
+    @staticmethod
+    def measure(client, case):
+        """Действие вьюсета и запросы одной проверки."""
+        cache.clear()
+        # Запрос откатывается, чтобы не менять данные следующих проверок.
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(client, case.method)(
+                    case.url, case.data, format='json')
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            transaction.set_rollback(True)
+        if response.status_code >= 400:
+            raise AssertionError(f'{case.name}: {case.method.upper()} '
+                                 f'{case.url} - {response.status_code}')
+        label, _ = action_label(response.resolver_match.func, case.method)
+        return label, queries.captured_queries
+
+    def assertBudgets(self, viewset):
+        labels = [label for label in self.budgets
+                  if label.split('.')[0] == viewset.__name__]
+        for label in labels:
+            self.assertIn(label, self.counts, 'действие не проверяется')
+            for name, counts in self.counts[label].items():
+                with self.subTest(label, case=name):
+                    details = '\n'.join(duplicated(self.captured[name]))
+                    self.assertLessEqual(max(counts), self.budgets[label],
+                                         details)
+                    self.assertEqual(counts[-1], counts[0],
+                                     'число запросов растёт с данными\n'
+                                     + details)
+
+    def test_every_action_has_budget(self):
+        self.assertCountEqual(self.counts, self.budgets)
+
+    def test_recipes(self):
+        self.assertBudgets(RecipeViewSet)
+
+    def test_users(self):
+        self.assertBudgets(UserViewSet)
+
+    def test_tags(self):
+        self.assertBudgets(TagViewSet)
+
+    def test_ingredients(self):
+        self.assertBudgets(IngredientViewSet)
+
+    def test_token_login(self):
+        self.assertBudgets(TokenLoginViewSet)
+
+
+@override_settings(METRICS_TOKEN='metrics-token')
+class MetricsAccessTests(APITestCase):
+    """Метрики доступны только персоналу и по токену."""
+
+    def test_access(self):
+        user = create_user('user')
+        self.assertEqual(self.client.get('/api/metrics').status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.assertEqual(
+            self.client.get('/api/metrics',
+                            HTTP_AUTHORIZATION='Bearer wrong').status_code,
+            status.HTTP_403_FORBIDDEN)
+        self.assertEqual(
+            self.client.get(
+                '/api/metrics',
+                HTTP_AUTHORIZATION='Bearer metrics-token').status_code,
+            status.HTTP_200_OK)
+        self.client.force_authenticate(user)
+        self.assertEqual(self.client.get('/api/metrics').status_code,
+                         status.HTTP_403_FORBIDDEN)
+        user.is_staff = True
+        self.assertEqual(self.client.get('/api/metrics').status_code,
+                         status.HTTP_200_OK)
+
+
+class ProfilingTests(APITestCase):
+    """Профиль по параметру profile хранит только последние отчёты."""
+
+    def test_reports_pruned(self):
+        user = create_user('staff', is_staff=True)
+        self.client.force_authenticate(user)
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+                PROFILING_ENABLED=True, PROFILING_DIR=directory,
+                PROFILING_MAX_REPORTS=2):
+            response = self.client.get('/api/tags/?unprofiled=1')
+            self.assertNotIn('X-Profile', response)
+            names = [self.client.get('/api/tags/?profile=1')['X-Profile']
+                     for _ in range(3)]
+            self.assertEqual(
+                sorted(name for name in os.listdir(directory)
+                       if name.endswith('.txt')),
+                [f'{name}.txt' for name in names[1:]])
+
+
+class ShoppingListStreamTests(APITestCase):
+    """astream() отдаёт тот же файл, что и stream()."""
+
+    def test_astream(self):
+        user = User(username='user', first_name='Имя', last_name='Фамилия')
+        shopping_list = [(f'Ингредиент {number}', 'г', number)
+                         for number in range(5000)]
+        today = datetime(2024, 1, 1)
+
+        async def collect(parts):
+            return [part async for part in parts]
+
+        for renderer_class in SHOPPING_LIST_RENDERERS:
+            # invariant: PDF без времени создания и случайного ID.
+            with self.subTest(renderer_class.format), patch.object(
+                    rl_config, 'invariant', 1):
+                renderer = renderer_class()
+                chunks = async_to_sync(collect)(
+                    renderer.astream(user, shopping_list, today))
+                expected = list(renderer.stream(user, shopping_list, today))
+                self.assertEqual(chunks[0][:0].join(chunks),
+                                 expected[0][:0].join(expected))
+                self.assertGreater(len(chunks), 1)
+
+    @override_settings(SHOPPING_LIST_FONT='/nonexistent/font.ttf')
+    def test_missing_font_warns(self):
+        with self.assertLogs('api.renderers', 'WARNING'):
+            self.assertEqual(ShoppingListPDFRenderer().get_font(),
+                             'Helvetica')
+
+
+class ConditionalGetTests(APITestCase):
+    """ETag меняется после фиксации записи, а не до неё."""
+
+    def test_etag_after_commit(self):
+        etag = self.client.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks() as callbacks:
+            Tag.objects.create(name='Тег', color='#FFFFFF', slug='tag')
+            # До фиксации транзакции версия прежняя.
+            self.assertEqual(self.client.get('/api/tags/')['ETag'], etag)
+        for callback in callbacks:
+            callback()
+        response = self.client.get('/api/tags/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data), 1)
@@ -1,8 +1,11 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .async_views import async_urls
 from .views import (IngredientViewSet, RecipeViewSet, TagViewSet,
-                    TokenLoginViewSet, TokenLogoutViewSet, UserViewSet)
+                    TokenLoginViewSet, TokenLogoutViewSet, UserViewSet,
+                    metrics)
 
 router_v1 = DefaultRouter()
 router_v1.register('tags', TagViewSet, basename='tags')
@@ -17,7 +20,12 @@ auth_urls = [
     path('token/logout/', TokenLogoutViewSet.as_view(), name='logout'),
 ]
 
+router_urls = router_v1.urls
+if settings.ASYNC_VIEWS:
+    router_urls = async_urls(router_urls)
+
 urlpatterns = [
-    path('', include(router_v1.urls)),
+    path('', include(router_urls)),
     path('auth/', include(auth_urls)),
+    path('metrics', metrics, name='metrics'),
 ]
@@ -1,9 +1,11 @@
 from datetime import datetime
+from hmac import compare_digest
 from urllib.parse import quote
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import mixins, status, viewsets
 from rest_framework.decorators import action
@@ -14,30 +16,84 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 
-from recipes.models import (FavoriteRecipe, Follow, Ingredient,
-                            IngredientAmount, Recipe, ShoppingCart, Tag, User)
+from recipes.models import (FavoriteRecipe, Follow, Ingredient, Recipe,
+                            ShoppingCart, Tag, User, annotate_is_subscribed)
+from recipes.relations import (add_relation, apply_batch, delete_recipe,
+                               remove_relation)
+from recipes.search import ingredient_index, search_ingredients
+from recipes.shopping_list import get_shopping_list
 from .filters import IngredientFilter, RecipeFilter
-from .paginators import PageLimitPagination
+from .metrics import CONTENT_TYPE, render_metrics
+from .middleware import is_staff
+from .mixins import AnonymousCacheMixin, AsyncReadMixin, ConditionalGetMixin
+from .paginators import FeedPagination, PageLimitPagination
+from .renderers import SHOPPING_LIST_RENDERERS
 from .permissions import IsRecipeAuthorOrReadOnly
 from .serializers import (FollowSerializer, IngredientSerializer,
                           RecipeFollowSerializer, RecipePostSerializer,
-                          RecipeSerializer, SetPasswordSerializer,
-                          TagSerializer, UserCreateSerializer,
-                          UserGetSerializer)
+                          RecipeSerializer, RelationBatchSerializer,
+                          SetPasswordSerializer, TagSerializer,
+                          UserCreateSerializer, UserGetSerializer)
 
 
-class UserViewSet(mixins.CreateModelMixin,
+def relation_batch(request, model):
+    """Пакетное добавление и удаление связей: {"add": [], "remove": []}."""
+    serializer = RelationBatchSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    return Response(
+        apply_batch(model, request.user, **serializer.validated_data))
+
+
+def metrics(request):
+    """Метрики запросов всех воркеров в текстовом формате Prometheus.
+
+    Доступны персоналу и по токену METRICS_TOKEN.
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (token and compare_digest(authorization.encode(),
+                                     f'Bearer {token}'.encode())
+            or is_staff(request)):
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
+
+
+class UserViewSet(AsyncReadMixin,
+                  mixins.CreateModelMixin,
                   mixins.ListModelMixin,
                   mixins.RetrieveModelMixin,
                   viewsets.GenericViewSet):
     queryset = User.objects.all()
+    lookup_value_regex = r'\d+'
     pagination_class = PageLimitPagination
+    cursor_ordering = ('username',)
+    async_actions = ('subscriptions',)
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return annotate_is_subscribed(User.objects.all(),
+                                          self.request.user)
+        return super().get_queryset()
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
             return UserGetSerializer
         return UserCreateSerializer
 
+    def get_follow_context(self, authors):
+        """Контекст FollowSerializer с рецептами всех авторов сразу."""
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit is not None and recipes_limit.isdigit():
+            recipes_limit = int(recipes_limit)
+        else:
+            recipes_limit = None
+        return {
+            'request': self.request,
+            'recipes_limit': recipes_limit,
+            'author_recipes': Recipe.objects.latest_by_author(
+                [author.pk for author in authors], recipes_limit),
+        }
+
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -89,40 +145,52 @@ class UserViewSet(mixins.CreateModelMixin,
         author = get_object_or_404(User, id=pk)
 
         if request.method == 'POST':
-            recipes_limit = request.query_params.get('recipes_limit')
-            follow_pair = Follow.objects.filter(user=user, following=author)
-            serializer = FollowSerializer(
-                author, context={'request': request,
-                                 'recipes_limit': recipes_limit})
-            if user != author and not follow_pair.exists():
-                Follow.objects.create(user=user, following=author)
+            if user != author and add_relation(Follow, user, author.pk):
+                serializer = FollowSerializer(
+                    author, context=self.get_follow_context([author]))
                 return Response(
                     serializer.data, status=status.HTTP_201_CREATED)
             return Response(
                 {'message': 'Unable to subscribe to the user.'},
                 status=status.HTTP_400_BAD_REQUEST)
 
-        try:
-            Follow.objects.filter(user=user, following=author).first().delete()
+        if remove_relation(Follow, user, author.pk):
             return Response(status=status.HTTP_204_NO_CONTENT)
-        except Exception:
-            return Response({'message':
-                             'Not subscribed to the user.'},
-                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({'message':
+                         'Not subscribed to the user.'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        url_path='subscribe/batch',
+        permission_classes=[IsAuthenticated])
+    def subscribe_batch(self, request):
+        return relation_batch(request, Follow)
 
     @action(
         methods=['GET'],
         detail=False,
-        permission_classes=[IsAuthenticated],)
+        permission_classes=[IsAuthenticated],
+        pagination_class=FeedPagination)
     def subscriptions(self, request):
-        queryset = User.objects.filter(follow_author__user=request.user)
-        recipes_limit = request.query_params.get('recipes_limit')
-        pages = self.paginate_queryset(queryset)
+        pages = self.paginate_queryset(self.get_subscriptions(request))
         serializer = FollowSerializer(
-            pages, many=True, context={'request': request,
-                                       'recipes_limit': recipes_limit})
+            pages, many=True, context=self.get_follow_context(pages))
         return self.get_paginated_response(serializer.data)
 
+    async def asubscriptions(self, request):
+        pages = await self.apaginate_queryset(
+            self.get_subscriptions(request))
+        context = await sync_to_async(self.get_follow_context)(pages)
+        serializer = FollowSerializer(pages, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
+
+    def get_subscriptions(self, request):
+        return annotate_is_subscribed(
+            User.objects.filter(follow_author__user=request.user),
+            request.user)
+
 
 class TokenLoginViewSet(APIView):
 
@@ -161,16 +229,21 @@ class TokenLogoutViewSet(APIView):
                             status=status.HTTP_401_UNAUTHORIZED)
 
 
-class TagViewSet(mixins.ListModelMixin,
+class TagViewSet(ConditionalGetMixin,
+                 AsyncReadMixin,
+                 mixins.ListModelMixin,
                  mixins.RetrieveModelMixin,
                  viewsets.GenericViewSet):
     """ViewSet для работы с тегами."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    etag_version_names = ('tags',)
 
 
-class IngredientViewSet(mixins.ListModelMixin,
+class IngredientViewSet(ConditionalGetMixin,
+                        AsyncReadMixin,
+                        mixins.ListModelMixin,
                         mixins.RetrieveModelMixin,
                         viewsets.GenericViewSet):
     """ViewSet для работы с ингридиентами."""
@@ -179,15 +252,48 @@ class IngredientViewSet(mixins.ListModelMixin,
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
     pagination_class = None
-
-
-class RecipeViewSet(viewsets.ModelViewSet):
+    etag_version_names = ('ingredients',)
+
+    def filter_queryset(self, queryset):
+        if self.action != 'list':
+            return super().filter_queryset(queryset)
+        search = self.request.query_params.get('search')
+        if search:
+            return search_ingredients(
+                search, settings.INGREDIENT_SEARCH_LIMIT)
+        name = self.request.query_params.get('name')
+        if name:
+            return ingredient_index.search(
+                name, settings.INGREDIENT_SEARCH_LIMIT)
+        return super().filter_queryset(queryset)
+
+
+class RecipeViewSet(ConditionalGetMixin,
+                    AnonymousCacheMixin,
+                    AsyncReadMixin,
+                    viewsets.ModelViewSet):
     """ViewSet для работы с рецептами."""
     queryset = Recipe.objects.all()
+    lookup_value_regex = r'\d+'
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
-    pagination_class = PageLimitPagination
+    pagination_class = FeedPagination
+    cursor_ordering = ('-pub_date', '-id')
+    ranked_query_params = ('search',)
     permission_classes = [IsRecipeAuthorOrReadOnly, IsAuthenticatedOrReadOnly]
+    conditional_actions = ('retrieve',)
+
+    def get_etag_version_names(self, request):
+        user = request.user
+        if user.is_anonymous:
+            return ('recipes',)
+        return ('recipes', f'favorites:{user.pk}', f'cart:{user.pk}',
+                f'follows:{user.pk}')
+
+    def get_queryset(self):
+        if self.action in ('list', 'retrieve'):
+            return Recipe.objects.for_read(self.request.user)
+        return super().get_queryset()
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -197,6 +303,9 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def perform_destroy(self, instance):
+        delete_recipe(instance)
+
     @action(
         methods=['POST', 'DELETE'],
         detail=True,
@@ -205,37 +314,35 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def favorite(self, request, pk=None):
         user = self.request.user
 
-        recipe = Recipe.objects.filter(id=pk).first()
-
-        if recipe is None:
-            if request.method == 'POST':
-                return Response({'message': 'Recipe does not exists!'},
-                                status=status.HTTP_400_BAD_REQUEST)
-            else:
-                return Response({'message': 'Recipe does not exists!'},
-                                status=status.HTTP_404_NOT_FOUND)
-
         if request.method == 'POST':
-            serializer = RecipeFollowSerializer(recipe)
-            if not FavoriteRecipe.objects.filter(user=user,
-                                                 recipe=recipe).exists():
-                FavoriteRecipe.objects.create(user=user, recipe=recipe)
+            if add_relation(FavoriteRecipe, user, pk):
+                serializer = RecipeFollowSerializer(Recipe.objects.get(id=pk))
                 return Response(
                     serializer.data, status=status.HTTP_201_CREATED)
+            if not Recipe.objects.filter(id=pk).exists():
+                return Response({'message': 'Recipe does not exists!'},
+                                status=status.HTTP_400_BAD_REQUEST)
             return Response(
                 {'message': 'Unable to add recipe to favorite.'},
                 status=status.HTTP_400_BAD_REQUEST)
 
         if request.method == 'DELETE':
-            follow_instance = FavoriteRecipe.objects.filter(
-                user=user, recipe=recipe).first()
-            try:
-                follow_instance.delete()
+            if remove_relation(FavoriteRecipe, user, pk):
                 return Response(status=status.HTTP_204_NO_CONTENT)
-            except Exception:
-                return Response({'message':
-                                'Recipe not in favorite.'},
-                                status=status.HTTP_400_BAD_REQUEST)
+            if not Recipe.objects.filter(id=pk).exists():
+                return Response({'message': 'Recipe does not exists!'},
+                                status=status.HTTP_404_NOT_FOUND)
+            return Response({'message':
+                            'Recipe not in favorite.'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+    @action(
+        methods=['POST'],
+        detail=False,
+        url_path='favorite/batch',
+        permission_classes=[IsAuthenticated])
+    def favorite_batch(self, request):
+        return relation_batch(request, FavoriteRecipe)
 
     @action(
         detail=True,
@@ -249,58 +356,53 @@ class RecipeViewSet(viewsets.ModelViewSet):
         else:
             return self.delete_from(ShoppingCart, user, pk)
 
-    def add_to(self, ShoppingCart, user, pk):
-        if ShoppingCart.objects.filter(user=user, recipe__id=pk).exists():
-            return Response({'message': 'Recipe already added!'},
-                            status=status.HTTP_400_BAD_REQUEST)
-        recipe = Recipe.objects.filter(id=pk).first()
-        if recipe is None:
+    @action(
+        methods=['POST'],
+        detail=False,
+        url_path='shopping_cart/batch',
+        permission_classes=[IsAuthenticated])
+    def shopping_cart_batch(self, request):
+        return relation_batch(request, ShoppingCart)
+
+    def add_to(self, model, user, pk):
+        if add_relation(model, user, pk):
+            serializer = RecipeFollowSerializer(Recipe.objects.get(id=pk))
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+        if not Recipe.objects.filter(id=pk).exists():
             return Response({'message': 'Recipe does not exists!'},
                             status=status.HTTP_400_BAD_REQUEST)
-        ShoppingCart.objects.create(user=user, recipe=recipe)
-        serializer = RecipeFollowSerializer(recipe)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response({'message': 'Recipe already added!'},
+                        status=status.HTTP_400_BAD_REQUEST)
 
-    def delete_from(self, ShoppingCart, user, pk):
+    def delete_from(self, model, user, pk):
+        if remove_relation(model, user, pk):
+            return Response(status=status.HTTP_204_NO_CONTENT)
         if not Recipe.objects.filter(id=pk).exists():
             return Response({'message': 'Recipe does not exists!'},
                             status=status.HTTP_404_NOT_FOUND)
-        if ShoppingCart.objects.filter(user=user, recipe__id=pk).exists():
-            ShoppingCart.objects.filter(user=user, recipe__id=pk).delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
         return Response({'message': 'Recipe already deleted!'},
                         status=status.HTTP_400_BAD_REQUEST)
 
     @action(
         detail=False,
-        permission_classes=[IsAuthenticated])
+        permission_classes=[IsAuthenticated],
+        renderer_classes=SHOPPING_LIST_RENDERERS)
     def download_shopping_cart(self, request):
         user = request.user
-        if not user.shopping_cart.exists():
+        shopping_list = get_shopping_list(user)
+        if not shopping_list:
             return Response(status=status.HTTP_400_BAD_REQUEST)
 
-        ingredients = IngredientAmount.objects.filter(
-            recipe__shopping_cart__user=request.user
-        ).values(
-            'ingredient__name',
-            'ingredient__measurement_unit'
-        ).annotate(amount=Sum('amount'))
-
-        today = datetime.today()
-        shopping_list = (
-            f'Список покупок для: {user.get_full_name()}\n\n'
-            f'Дата: {today:%Y-%m-%d}\n\n'
-        )
-        shopping_list += '\n'.join([
-            f'- {ingredient["ingredient__name"]} '
-            f'({ingredient["ingredient__measurement_unit"]})'
-            f' - {ingredient["amount"]}'
-            for ingredient in ingredients
-        ])
-        shopping_list += f'\n\nFoodgram ({today:%Y})'
-        filename = f'{user.username}_shopping_list.txt'
+        renderer = request.accepted_renderer
+        # Под ASGI ответ отдаётся асинхронным итератором, синхронный
+        # Django прочитал бы целиком до отправки.
+        stream = (renderer.astream if settings.ASYNC_VIEWS
+                  else renderer.stream)
+        response = StreamingHttpResponse(
+            stream(user, shopping_list, datetime.today()),
+            content_type=renderer.content_type)
+        filename = f'{user.username}_shopping_list.{renderer.extension}'
         quoted_filename = quote(filename)
-        response = HttpResponse(shopping_list, content_type='text/plain')
         response['Content-Disposition'] = (
             f'attachment; filename="{quoted_filename}"')
 
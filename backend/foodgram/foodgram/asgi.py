@@ -0,0 +1,22 @@
+"""
+ASGI config for foodgram project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+Run with uvicorn workers, e.g.:
+gunicorn -k uvicorn.workers.UvicornWorker -w 4 foodgram.asgi
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+os.environ.setdefault('ASYNC_VIEWS', 'True')
+# Запросы выполняются в отдельных потоках, соединения берутся из пула.
+os.environ.setdefault('DB_POOL_SIZE', '10')
+
+application = get_asgi_application()
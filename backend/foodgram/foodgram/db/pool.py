@@ -0,0 +1,113 @@
+"""Пул соединений в процессе и учёт их установки.
+
+ConnectionReuseMixin подмешивается к DatabaseWrapper бэкенда. Он
+считает открытые и взятые из пула соединения и время их установки,
+включая проверку CONN_HEALTH_CHECKS, а MetricsMiddleware переводит
+разницу счётчиков за запрос в метрики.
+
+При POOL_SIZE > 0 в настройках базы Django по-прежнему закрывает
+соединение в конце запроса (CONN_MAX_AGE = 0), но закрытие возвращает
+его в пул процесса, и следующий запрос любого потока берёт готовое
+соединение вместо нового подключения. Пул хранит не больше POOL_SIZE
+простаивающих соединений; число одновременно открытых не ограничено.
+"""
+import os
+import threading
+import time
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    """Простаивающие соединения одной базы в текущем процессе."""
+
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # Соединения, унаследованные от мастера gunicorn через fork,
+        # воркеру использовать нельзя: их сокеты общие с мастером.
+        self.pid = os.getpid()
+        self.idle = []
+
+    def get(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.reset()
+            return self.idle.pop() if self.idle else None
+
+    def put(self, connection):
+        with self.lock:
+            if self.pid != os.getpid() or len(self.idle) >= self.size:
+                return False
+            self.idle.append(connection)
+            return True
+
+
+def get_pool(alias, size):
+    if not size:
+        return None
+    with pools_lock:
+        if alias not in pools:
+            pools[alias] = ConnectionPool(size)
+        return pools[alias]
+
+
+class ConnectionReuseMixin:
+    """Пул и учёт соединений для DatabaseWrapper.
+
+    Бэкенд реализует connection_reusable(connection, check): можно ли
+    вернуть сырое соединение в пул (check=False) или выдать из пула
+    запросу (check=True, с проверкой связи при CONN_HEALTH_CHECKS).
+    """
+    connections_opened = 0
+    connections_pooled = 0
+    connection_setup_time = 0
+    connection_from_pool = False
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict.get('POOL_SIZE'))
+
+    def connection_usage(self):
+        """(открыто, взято из пула, секунд на установку) с начала работы."""
+        return (self.connections_opened, self.connections_pooled,
+                self.connection_setup_time)
+
+    def connect(self):
+        start = time.perf_counter()
+        self.connection_from_pool = False
+        super().connect()
+        self.connection_setup_time += time.perf_counter() - start
+        if self.connection_from_pool:
+            self.connections_pooled += 1
+        else:
+            self.connections_opened += 1
+
+    def close_if_health_check_failed(self):
+        start = time.perf_counter()
+        super().close_if_health_check_failed()
+        self.connection_setup_time += time.perf_counter() - start
+
+    def get_new_connection(self, conn_params):
+        pool = self.pool
+        while pool is not None:
+            connection = pool.get()
+            if connection is None:
+                break
+            if self.connection_reusable(connection, check=True):
+                self.connection_from_pool = True
+                return connection
+            connection.close()
+        return super().get_new_connection(conn_params)
+
+    def _close(self):
+        pool = self.pool
+        if (pool is not None
+                and self.connection_reusable(self.connection, check=False)
+                and pool.put(self.connection)):
+            return
+        super()._close()
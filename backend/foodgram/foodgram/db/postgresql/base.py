@@ -0,0 +1,23 @@
+"""PostgreSQL с учётом соединений и необязательным пулом в процессе."""
+from django.db.backends.postgresql import base
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+from ..pool import ConnectionReuseMixin
+
+
+class DatabaseWrapper(ConnectionReuseMixin, base.DatabaseWrapper):
+
+    def connection_reusable(self, connection, check):
+        # В пул попадают только соединения вне транзакции: незавершённая
+        # транзакция или ошибка достались бы следующему запросу.
+        if (connection.closed
+                or connection.info.transaction_status
+                != TRANSACTION_STATUS_IDLE):
+            return False
+        if check and self.settings_dict['CONN_HEALTH_CHECKS']:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            except self.Database.Error:
+                return False
+        return True
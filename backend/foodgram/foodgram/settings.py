@@ -47,6 +47,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework_simplejwt',
     'rest_framework_simplejwt.token_blacklist',
     'recipes',
@@ -58,6 +59,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -65,6 +67,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -86,22 +89,105 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'foodgram.wsgi.application'
+ASGI_APPLICATION = 'foodgram.asgi.application'
+
+# Асинхронное чтение рецептов, тегов, ингредиентов и подписок. Включается
+# в foodgram/asgi.py: под WSGI каждая корутина запускала бы свой цикл
+# событий.
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', 'False') in ('True', 'true', '1', 1)
 
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
+# Соединения с базой. DB_CONN_MAX_AGE - сколько секунд соединение живёт
+# между запросами (0 - закрывать после каждого, None - без ограничения);
+# перед первым запросом к переиспользуемому соединению выполняется SELECT 1.
+# DB_POOL_SIZE > 0 включает пул в процессе (foodgram.db.pool): соединение
+# возвращается в пул в конце запроса и достаётся следующему, в том числе
+# из другого потока. Под ASGI каждый запрос работает в своём потоке, и
+# постоянное соединение не переживает запрос, поэтому там нужен пул.
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 0))
+DB_CONN_MAX_AGE = os.getenv('DB_CONN_MAX_AGE', '60')
+DB_CONN_MAX_AGE = None if DB_CONN_MAX_AGE == 'None' else int(DB_CONN_MAX_AGE)
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': 'foodgram.db.postgresql',
         'NAME': os.getenv('POSTGRES_DB', 'foodgram'),
         'USER': os.getenv('POSTGRES_USER', 'foodgram_user'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'foodgram_password'),
         'HOST': os.getenv('DB_HOST', 'db'),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': 0 if DB_POOL_SIZE else DB_CONN_MAX_AGE,
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'True') in (
+            'True', 'true', '1', 1),
+        'POOL_SIZE': DB_POOL_SIZE,
+    }
+}
+
+
+# Cache
+# Версии данных (recipes.versions) и кеш ответов хранятся здесь. При
+# нескольких воркерах gunicorn нужен общий бэкенд (Redis, Memcached),
+# заданный через CACHE_BACKEND и CACHE_LOCATION.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
     }
 }
 
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 60 * 15))
+
+# Максимум подсказок в автодополнении ингредиентов (?name=).
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+
+# Минимальное сходство триграмм слова для нечёткого поиска (?search=).
+INGREDIENT_FUZZY_THRESHOLD = float(
+    os.getenv('INGREDIENT_FUZZY_THRESHOLD', 0.15))
+
+# Максимум id в add и remove пакетных эндпоинтов (favorite/batch и др.).
+RELATION_BATCH_SIZE = int(os.getenv('RELATION_BATCH_SIZE', 500))
+
+# TTF-шрифт с кириллицей для выгрузки списка покупок в PDF.
+SHOPPING_LIST_FONT = os.getenv(
+    'SHOPPING_LIST_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
+# Ширины уменьшенных копий картинок рецептов (WebP и JPEG) и число
+# потоков, которые строят их в фоне.
+RECIPE_IMAGE_WIDTHS = tuple(int(width) for width in os.getenv(
+    'RECIPE_IMAGE_WIDTHS', '320,640,1280').split(','))
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))
+
+# Ограничения загружаемых картинок: размер файла в байтах и число
+# пикселей. Размер проверяется до декодирования base64.
+MAX_IMAGE_UPLOAD_SIZE = int(
+    os.getenv('MAX_IMAGE_UPLOAD_SIZE', 10 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 40 * 10 ** 6))
+
+# Метрики запросов для /api/metrics. Воркеры gunicorn пишут свои значения
+# в файлы METRICS_DIR (их удаляет gunicorn.conf.py при запуске), эндпоинт
+# их суммирует. Без METRICS_DIR метрики отдаются только из текущего
+# процесса. Эндпоинт доступен персоналу и по заголовку
+# Authorization: Bearer METRICS_TOKEN.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') in (
+    'True', 'true', '1', 1)
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 1))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Профиль запроса для персонала по заголовку X-Profile или ?profile=1.
+# Отчёты с SQL-запросами сохраняются в PROFILING_DIR, хранятся последние
+# PROFILING_MAX_REPORTS. По умолчанию выключено.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') in (
+    'True', 'true', '1', 1)
+PROFILING_DIR = os.getenv('PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILING_MAX_REPORTS = int(os.getenv('PROFILING_MAX_REPORTS', 50))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -147,6 +233,17 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Медиафайлы называются по хешу содержимого: одинаковые картинки
+# хранятся один раз (recipes.storage).
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipes.storage.ContentHashStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
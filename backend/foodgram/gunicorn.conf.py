@@ -0,0 +1,13 @@
+"""Настройки gunicorn: файл читается из рабочего каталога при запуске."""
+import os
+from pathlib import Path
+
+
+def on_starting(server):
+    # Файлы METRICS_DIR от воркеров прошлого запуска эндпоинт метрик
+    # суммировал бы вместе с новыми.
+    metrics_dir = os.getenv('METRICS_DIR')
+    if metrics_dir and os.path.isdir(metrics_dir):
+        for path in Path(metrics_dir).iterdir():
+            if path.is_file():
+                path.unlink(missing_ok=True)
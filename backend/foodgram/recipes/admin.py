@@ -18,6 +18,9 @@ class TagAdmin(admin.ModelAdmin):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (IngredientAmountInline,)
+    list_display = ('name', 'author', 'favorites_count',
+                    'shopping_cart_count')
+    readonly_fields = ('favorites_count', 'shopping_cart_count')
 
 
 @admin.register(Ingredient)
@@ -0,0 +1,55 @@
+"""Денормализованные счётчики рецептов, избранного и списков покупок."""
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import FavoriteRecipe, Recipe, ShoppingCart, User
+
+# (модель-источник, внешний ключ, модель со счётчиком, поле счётчика)
+COUNTERS = (
+    (Recipe, 'author', User, 'recipes_count'),
+    (FavoriteRecipe, 'recipe', Recipe, 'favorites_count'),
+    (ShoppingCart, 'recipe', Recipe, 'shopping_cart_count'),
+)
+
+
+def update_counters(sender, instances, delta):
+    """Сдвигает счётчики для созданных (+1) или удалённых (-1) записей.
+
+    Записи группируются по количеству на объект, поэтому пакет любого
+    размера обходится одним UPDATE на каждое различное количество.
+    """
+    for source, foreign_key, model, field in COUNTERS:
+        if source is not sender:
+            continue
+        totals = Counter(getattr(instance, f'{foreign_key}_id')
+                         for instance in instances)
+        groups = defaultdict(list)
+        for pk, total in totals.items():
+            groups[total].append(pk)
+        for total, pks in groups.items():
+            model.objects.filter(pk__in=pks).update(
+                **{field: Greatest(F(field) + delta * total, 0)})
+
+
+def actual_count(source, foreign_key):
+    return Coalesce(Subquery(
+        source.objects.filter(**{foreign_key: OuterRef('pk')})
+        .order_by().values(foreign_key)
+        .annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def recount(fix=True):
+    """Пересчитывает счётчики, возвращает число расхождений по полям."""
+    drift = {}
+    for source, foreign_key, model, field in COUNTERS:
+        actual = actual_count(source, foreign_key)
+        drifted = model.objects.annotate(actual=actual).exclude(
+            **{field: F('actual')})
+        drift[f'{model.__name__}.{field}'] = drifted.count()
+        if fix and drift[f'{model.__name__}.{field}']:
+            model.objects.filter(pk__in=drifted.values('pk')).update(
+                **{field: actual})
+    return drift
@@ -0,0 +1,149 @@
+"""Уменьшенные копии картинок рецептов в WebP и JPEG.
+
+Копии строятся в фоновом потоке после фиксации транзакции, поэтому
+сохранение рецепта не ждёт перекодирования. В Recipe.image_variants
+хранится {'source': имя оригинала, 'width': ..., 'height': ...,
+'webp': {ширина: имя файла}, 'jpeg': {...}}. Копии, построенные для
+другого оригинала, считаются устаревшими; их перестраивает команда
+generate_image_variants.
+"""
+import base64
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Recipe
+from .versions import bump_version
+
+logger = logging.getLogger(__name__)
+
+VARIANTS_DIR = 'recipes/variants'
+# формат: (расширение, MIME-тип, параметры сохранения)
+FORMATS = {
+    'webp': ('webp', 'image/webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('jpg', 'image/jpeg', {'quality': 82, 'optimize': True,
+                                   'progressive': True}),
+}
+
+executor = ThreadPoolExecutor(max_workers=settings.IMAGE_VARIANT_WORKERS,
+                              thread_name_prefix='image-variants')
+
+
+def variant_name(source, width, extension):
+    stem, _ = os.path.splitext(os.path.basename(source))
+    return f'{VARIANTS_DIR}/{stem}-{width}w.{extension}'
+
+
+def variants_actual(variants, source):
+    return bool(variants) and variants.get('source') == source
+
+
+def build_variants(source):
+    """Строит копии картинки source и возвращает описание для БД."""
+    widths = sorted(settings.RECIPE_IMAGE_WIDTHS, reverse=True)
+    with default_storage.open(source) as file:
+        image = Image.open(file)
+        # Для JPEG декодер сразу уменьшает картинку в 2-8 раз, если
+        # самая большая копия это позволяет: многомегабайтные снимки не
+        # распаковываются целиком.
+        image.draft('RGB', (widths[0], widths[0] * image.height
+                            // image.width))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert(
+                'RGBA' if 'transparency' in image.info else 'RGB')
+        image.load()
+    width, height = image.size
+    targets = [target for target in widths if target < width] or [width]
+    variants = {'source': source, 'width': width, 'height': height}
+    current = image
+    for target in targets:
+        # Каждая копия уменьшается из предыдущей, а не из оригинала.
+        current = current.resize(
+            (target, max(1, round(height * target / width))),
+            Image.LANCZOS, reducing_gap=3.0)
+        for name, (extension, _, options) in FORMATS.items():
+            frame = current
+            if name == 'jpeg' and frame.mode != 'RGB':
+                frame = frame.convert('RGB')
+            buffer = BytesIO()
+            frame.save(buffer, name.upper(), **options)
+            path = variant_name(source, target, extension)
+            variants.setdefault(name, {})[str(target)] = default_storage.save(
+                path, ContentFile(buffer.getvalue()))
+    return variants
+
+
+def save_variants(source, variants, recipes=None):
+    """Записывает копии рецептам, у которых картинка всё ещё source."""
+    queryset = Recipe.objects.filter(image=source)
+    if recipes is not None:
+        queryset = queryset.filter(pk__in=recipes)
+    updated = queryset.update(image_variants=variants)
+    if updated:
+        bump_version('recipes')
+    return updated
+
+
+def generate_variants(recipe_id, source):
+    try:
+        save_variants(source, build_variants(source), [recipe_id])
+    except (OSError, UnidentifiedImageError) as error:
+        logger.warning('Не удалось построить копии картинки %s: %s',
+                       source, error)
+    except Exception:
+        logger.exception('Не удалось построить копии картинки %s', source)
+    finally:
+        # Поток пула переиспользуется, соединение с БД ему не нужно.
+        connection.close()
+
+
+def schedule_variants(recipe):
+    """Ставит построение копий в очередь после фиксации транзакции."""
+    source = recipe.image.name
+    if not source or variants_actual(recipe.image_variants, source):
+        return
+    transaction.on_commit(
+        lambda: executor.submit(generate_variants, recipe.pk, source))
+
+
+def image_srcset(recipe, request=None):
+    """{MIME-тип: 'url 320w, url 640w'} для <picture> и <source srcset>.
+
+    Пока копии не построены, словарь пуст и клиент берёт image.
+    """
+    variants = recipe.image_variants
+    if not variants_actual(variants, recipe.image.name):
+        return {}
+    srcset = {}
+    for name, (_, content_type, _) in FORMATS.items():
+        items = []
+        for width, path in sorted(variants.get(name, {}).items(),
+                                  key=lambda item: int(item[0])):
+            url = default_storage.url(path)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            items.append(f'{url} {width}w')
+        if items:
+            srcset[content_type] = ', '.join(items)
+    return srcset
+
+
+def image_data(image=None, format='PNG', **params):
+    """Картинка в виде data URI, как её принимает поле image в API.
+
+    Без картинки - однотонная PNG 8x8 для тестов и бенчмарков.
+    """
+    if image is None:
+        image = Image.new('RGB', (8, 8), (230, 108, 45))
+    buffer = BytesIO()
+    image.save(buffer, format, **params)
+    return (f'data:{Image.MIME[format]};base64,'
+            + base64.b64encode(buffer.getvalue()).decode())
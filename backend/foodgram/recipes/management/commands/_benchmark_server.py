@@ -0,0 +1,39 @@
+"""Приложения для серверов команды asgi_benchmark.
+
+Модуль загружается воркерами gunicorn до настройки Django, поэтому не
+импортирует ничего, что требует готового реестра приложений. Имя с
+подчёркиванием: Django не считает модуль командой manage.py.
+"""
+import os
+import time
+
+from django.db.backends.signals import connection_created
+
+QUERY_DELAY_ENV = 'BENCHMARK_QUERY_DELAY'
+
+
+def server_application(kind):
+    """Приложение для воркеров gunicorn с задержкой каждого SQL-запроса.
+
+    Задержка из BENCHMARK_QUERY_DELAY (секунды) имитирует сеть до
+    удалённой базы: синхронный воркер на это время простаивает, а под
+    ASGI поток запроса ждёт, пока цикл событий обслуживает другие.
+    """
+    if kind == 'asgi':
+        from foodgram.asgi import application
+    else:
+        from foodgram.wsgi import application
+    delay = float(os.environ.get(QUERY_DELAY_ENV, 0))
+
+    def sleep(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+
+    def add_delay(connection, **kwargs):
+        # Сигнал приходит при каждом переподключении той же обёртки.
+        if sleep not in connection.execute_wrappers:
+            connection.execute_wrappers.append(sleep)
+
+    if delay:
+        connection_created.connect(add_delay, weak=False)
+    return application
@@ -0,0 +1,201 @@
+import json
+import statistics
+import tempfile
+import time
+from collections import namedtuple
+from contextlib import nullcontext
+from urllib.parse import quote
+
+from api.middleware import QueryTimer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+from django.test.utils import override_settings
+from recipes.images import image_data
+from recipes.models import Follow, Ingredient, Recipe, Tag, User
+from rest_framework.test import APIClient
+
+# docker compose exec backend python manage.py api_benchmark \
+# --requests 200 --output bench.json
+
+Scenario = namedtuple('Scenario', 'name method url data write anonymous',
+                      defaults=(None, False, False))
+
+
+def percentile(timings, percent):
+    return statistics.quantiles(timings, n=100, method='inclusive')[
+        percent - 1]
+
+
+class Command(BaseCommand):
+    help = ('Нагрузочный прогон API в процессе: задержки p50/p95/p99, '
+            'пропускная способность и число SQL-запросов по сценариям')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Разогревочных запросов на сценарий')
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+        parser.add_argument('--label', default='',
+                            help='Метка прогона в JSON, например коммит')
+        parser.add_argument('scenarios', nargs='*',
+                            help='Имена сценариев; по умолчанию все')
+
+    def handle(self, *args, **options):
+        user = (User.objects.filter(shopping_cart__isnull=False)
+                .order_by('-recipes_count', 'pk').first())
+        if user is None or not user.recipes_count:
+            raise CommandError(
+                'Нужен пользователь с рецептами и списком покупок, '
+                'сначала выполните generate_data')
+        scenarios = self.scenarios(user)
+        if options['scenarios']:
+            unknown = set(options['scenarios']) - {
+                scenario.name for scenario in scenarios}
+            if unknown:
+                raise CommandError(f'Нет сценариев: {", ".join(unknown)}')
+            scenarios = [scenario for scenario in scenarios
+                         if scenario.name in options['scenarios']]
+
+        client = APIClient()
+        client.force_authenticate(user)
+        anonymous = APIClient()
+        results = {}
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+                ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+                MEDIA_ROOT=media_root):
+            for scenario in scenarios:
+                results[scenario.name] = self.run(
+                    anonymous if scenario.anonymous else client,
+                    scenario, options)
+                self.report(scenario.name, results[scenario.name])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'label': options['label'],
+                    'database': connection.vendor,
+                    'requests': options['requests'],
+                    'data': {
+                        'users': User.objects.count(),
+                        'recipes': Recipe.objects.count(),
+                        'ingredients': Ingredient.objects.count(),
+                    },
+                    'scenarios': results,
+                }, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты записаны в {options["output"]}'))
+
+    def scenarios(self, user):
+        recipe = Recipe.objects.order_by('-favorites_count', 'pk').first()
+        own_recipe = Recipe.objects.filter(author=user).first()
+        tags = '&'.join(f'tags={slug}' for slug in
+                        Tag.objects.values_list('slug', flat=True)[:2])
+        author = (User.objects.exclude(pk=user.pk).exclude(
+            pk__in=Follow.objects.filter(user=user).values('following'))
+            .order_by('-recipes_count', 'pk').first())
+        target = Recipe.objects.exclude(favorites__user=user).exclude(
+            shopping_cart__user=user).order_by('pk').first()
+        carted = Recipe.objects.filter(shopping_cart__user=user).first()
+        ingredient = (Ingredient.objects.annotate(
+            uses=Count('ingredientamount')).order_by('-uses', 'pk').first())
+        prefix, query = quote(ingredient.name[:2]), quote(ingredient.name[:5])
+        ingredients = list(Ingredient.objects.order_by('pk').values_list(
+            'pk', flat=True)[:5])
+        recipe_data = {
+            'ingredients': [{'id': pk, 'amount': 10} for pk in ingredients],
+            'tags': list(Tag.objects.values_list('pk', flat=True)[:2]),
+            'image': image_data(),
+            'name': 'Бенчмарк',
+            'text': 'Рецепт для нагрузочного теста.',
+            'cooking_time': 10,
+        }
+        return [
+            Scenario('recipes_list', 'get', '/api/recipes/'),
+            Scenario('recipes_list_anonymous', 'get', '/api/recipes/',
+                     anonymous=True),
+            Scenario('recipes_list_tags', 'get', f'/api/recipes/?{tags}'),
+            Scenario('recipes_list_favorited', 'get',
+                     '/api/recipes/?is_favorited=1'),
+            Scenario('recipes_list_author', 'get',
+                     f'/api/recipes/?author={user.pk}&limit=20'),
+            Scenario('recipes_list_cursor', 'get',
+                     '/api/recipes/?pagination=cursor'),
+            Scenario('recipes_search', 'get',
+                     f'/api/recipes/?search={quote("суп")}'),
+            Scenario('recipe_detail', 'get', f'/api/recipes/{recipe.pk}/'),
+            Scenario('subscriptions', 'get',
+                     '/api/users/subscriptions/?recipes_limit=3'),
+            Scenario('ingredients_autocomplete', 'get',
+                     f'/api/ingredients/?name={prefix}'),
+            Scenario('ingredients_search', 'get',
+                     f'/api/ingredients/?search={query}'),
+            Scenario('shopping_cart_download', 'get',
+                     '/api/recipes/download_shopping_cart/'),
+            Scenario('shopping_cart_download_pdf', 'get',
+                     '/api/recipes/download_shopping_cart/?format=pdf'),
+            Scenario('recipe_create', 'post', '/api/recipes/',
+                     recipe_data, write=True),
+            Scenario('recipe_update', 'patch',
+                     f'/api/recipes/{own_recipe.pk}/', recipe_data,
+                     write=True),
+            Scenario('favorite_add', 'post',
+                     f'/api/recipes/{target.pk}/favorite/', write=True),
+            Scenario('shopping_cart_add', 'post',
+                     f'/api/recipes/{target.pk}/shopping_cart/', write=True),
+            Scenario('shopping_cart_remove', 'delete',
+                     f'/api/recipes/{carted.pk}/shopping_cart/', write=True),
+            Scenario('subscribe', 'post',
+                     f'/api/users/{author.pk}/subscribe/', write=True),
+        ]
+
+    def request(self, client, scenario):
+        response = getattr(client, scenario.method)(
+            scenario.url, scenario.data, format='json')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def run(self, client, scenario, options):
+        timings, queries, statuses = [], [], set()
+        for number in range(options['warmup'] + options['requests']):
+            timer = QueryTimer()
+            # Записи откатываются, чтобы каждый запрос видел те же данные.
+            with transaction.atomic() if scenario.write else nullcontext():
+                with timer:
+                    start = time.perf_counter()
+                    response = self.request(client, scenario)
+                    elapsed = time.perf_counter() - start
+                if scenario.write:
+                    transaction.set_rollback(True)
+            if number >= options['warmup']:
+                timings.append(elapsed * 1000)
+                queries.append(timer.count)
+                statuses.add(response.status_code)
+        return {
+            'url': scenario.url,
+            'method': scenario.method.upper(),
+            'statuses': sorted(statuses),
+            'p50_ms': round(percentile(timings, 50), 3),
+            'p95_ms': round(percentile(timings, 95), 3),
+            'p99_ms': round(percentile(timings, 99), 3),
+            'mean_ms': round(statistics.mean(timings), 3),
+            'throughput_rps': round(1000 * len(timings) / sum(timings), 1),
+            'queries_mean': round(statistics.mean(queries), 2),
+            'queries_max': max(queries),
+        }
+
+    def report(self, name, result):
+        style = (self.style.SUCCESS if all(
+            status < 400 for status in result['statuses'])
+            else self.style.WARNING)
+        self.stdout.write(style(
+            f'{name:28} {",".join(map(str, result["statuses"])):>7} '
+            f'p50={result["p50_ms"]:8.2f} мс '
+            f'p95={result["p95_ms"]:8.2f} мс '
+            f'p99={result["p99_ms"]:8.2f} мс '
+            f'{result["throughput_rps"]:8.1f} rps '
+            f'SQL={result["queries_mean"]:.1f} (max {result["queries_max"]})'
+        ))
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict, namedtuple
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from recipes.images import image_data
+from recipes.management.commands._benchmark_server import QUERY_DELAY_ENV
+from recipes.management.commands.api_benchmark import percentile
+from recipes.models import Ingredient, Recipe, Tag, User
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# docker compose exec backend python manage.py asgi_benchmark \
+# --workers 4 --concurrency 64 --query-delay 2
+
+WORKER_CLASSES = {
+    'wsgi': 'sync',
+    'asgi': 'uvicorn.workers.UvicornWorker',
+}
+STARTUP_TIMEOUT = 30
+# Размер загружаемой картинки, пикселей.
+UPLOAD_SIZE = (1600, 1200)
+
+Scenario = namedtuple('Scenario', 'path authenticated method body',
+                      defaults=('GET', None))
+
+
+async def fetch(host, port, path, headers, method='GET', body=None):
+    """Запрос по отдельному соединению, как nginx без keepalive к upstream.
+
+    body - JSON-тело запроса.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {host}',
+                 'Connection: close', *headers]
+        if body is not None:
+            lines += ['Content-Type: application/json',
+                      f'Content-Length: {len(body)}']
+        writer.write('\r\n'.join([*lines, '', '']).encode())
+        if body is not None:
+            writer.write(body)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    return int(response.split(b' ', 2)[1])
+
+
+class Server:
+    """gunicorn в дочернем процессе на время замера одного режима."""
+
+    def __init__(self, command, env, host, port):
+        self.command, self.env = command, env
+        self.host, self.port = host, port
+
+    def __enter__(self):
+        self.log = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(
+            self.command, env=self.env, cwd=settings.BASE_DIR,
+            stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                break
+            try:
+                if asyncio.run(fetch(
+                        self.host, self.port, '/api/tags/', [])) == 200:
+                    return self
+            except OSError:
+                pass
+            time.sleep(0.2)
+        output = self.output()
+        self.__exit__()
+        raise CommandError(f'gunicorn не запустился:\n{output}')
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=STARTUP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+    def output(self):
+        self.log.seek(0)
+        return self.log.read().decode(errors='replace')
+
+
+class Command(BaseCommand):
+    help = ('Сравнение WSGI (синхронные воркеры gunicorn) и ASGI (uvicorn) '
+            'при одинаковом числе воркеров под конкурентной нагрузкой: '
+            'чтение, выгрузка списка покупок и загрузка картинки рецепта '
+            '(рецепт перезаписывается теми же данными)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Воркеров gunicorn в обоих режимах')
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Одновременных клиентов')
+        parser.add_argument('--duration', type=float, default=10,
+                            help='Секунд нагрузки на режим')
+        parser.add_argument('--warmup', type=float, default=2,
+                            help='Секунд разогрева перед замером')
+        parser.add_argument('--query-delay', type=float, default=0,
+                            help='Задержка каждого SQL-запроса, мс')
+        parser.add_argument('--modes', nargs='+', default=['wsgi', 'asgi'],
+                            choices=WORKER_CLASSES)
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--output', help='Файл для результатов в JSON')
+
+    def handle(self, *args, **options):
+        paths, headers = self.scenarios()
+        results = {}
+        for mode in options['modes']:
+            with self.server(mode, options):
+                self.load(paths, headers, options, options['warmup'])
+                results[mode] = self.load(
+                    paths, headers, options, options['duration'])
+            self.report(mode, results[mode])
+        if {'wsgi', 'asgi'} <= results.keys() and results['wsgi']['rps']:
+            self.stdout.write(self.style.SUCCESS(
+                'ASGI/WSGI: {:.2f}x по пропускной способности, p95 '
+                '{:.2f}x'.format(
+                    results['asgi']['rps'] / results['wsgi']['rps'],
+                    results['asgi']['p95_ms'] / results['wsgi']['p95_ms'])))
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump({
+                    'workers': options['workers'],
+                    'concurrency': options['concurrency'],
+                    'duration': options['duration'],
+                    'query_delay_ms': options['query_delay'],
+                    'modes': results,
+                }, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты записаны в {options["output"]}'))
+
+    def scenarios(self):
+        # Пользователь с подписками, списком покупок и своими рецептами.
+        user = User.objects.filter(
+            follow_follower__isnull=False, shopping_cart__isnull=False,
+            authors__isnull=False).first()
+        recipe = Recipe.objects.order_by('-favorites_count', 'pk').first()
+        ingredient = Ingredient.objects.order_by('pk').first()
+        if user is None or recipe is None or ingredient is None:
+            raise CommandError(
+                'Нужны рецепты, ингредиенты, подписки и списки покупок, '
+                'сначала выполните generate_data')
+        tag = Tag.objects.order_by('pk').first()
+        header_type = settings.SIMPLE_JWT['AUTH_HEADER_TYPES'][0]
+        token = RefreshToken.for_user(user).access_token
+        own_recipe = user.authors.order_by('pk').first()
+        paths = {
+            'recipes_list': Scenario('/api/recipes/', True),
+            'recipes_list_anonymous': Scenario('/api/recipes/?limit=6',
+                                               False),
+            'recipe_detail': Scenario(f'/api/recipes/{recipe.pk}/', True),
+            'tags_list': Scenario('/api/tags/', False),
+            'ingredients_autocomplete': Scenario(
+                f'/api/ingredients/?name={quote(ingredient.name[:2])}',
+                False),
+            'subscriptions': Scenario(
+                '/api/users/subscriptions/?recipes_limit=3', True),
+            'shopping_cart_download': Scenario(
+                '/api/recipes/download_shopping_cart/?format=pdf', True),
+            'image_upload': Scenario(
+                f'/api/recipes/{own_recipe.pk}/', True, 'PATCH',
+                self.upload_body(own_recipe)),
+        }
+        if tag is not None:
+            paths['recipes_list_tag'] = Scenario(
+                f'/api/recipes/?tags={quote(tag.slug)}', True)
+        return paths, [f'Authorization: {header_type} {token}']
+
+    def upload_body(self, recipe):
+        """Данные рецепта с новой картинкой, картинка строится один раз."""
+        image = image_data(
+            Image.effect_noise(UPLOAD_SIZE, 64).convert('RGB'), 'JPEG',
+            quality=90)
+        amounts = recipe.ingredientamount_set.values_list(
+            'ingredient', 'amount')
+        return json.dumps({
+            'ingredients': [{'id': ingredient, 'amount': amount}
+                            for ingredient, amount in amounts],
+            'tags': list(recipe.tags.values_list('pk', flat=True)),
+            'image': image,
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+        }).encode()
+
+    def server(self, mode, options):
+        command = [
+            sys.executable, '-m', 'gunicorn',
+            '--workers', str(options['workers']),
+            '--worker-class', WORKER_CLASSES[mode],
+            '--bind', f'{options["host"]}:{options["port"]}',
+            '--log-level', 'warning',
+            'recipes.management.commands._benchmark_server:'
+            f'server_application("{mode}")',
+        ]
+        env = {
+            **os.environ,
+            'ASYNC_VIEWS': str(mode == 'asgi'),
+            QUERY_DELAY_ENV: str(options['query_delay'] / 1000),
+        }
+        return Server(command, env, options['host'], options['port'])
+
+    def load(self, paths, headers, options, duration):
+        return asyncio.run(self.aload(paths, headers, options, duration))
+
+    async def aload(self, paths, headers, options, duration):
+        timings, errors = defaultdict(list), defaultdict(int)
+        names = list(paths)
+        deadline = time.perf_counter() + duration
+
+        async def client(number):
+            while time.perf_counter() < deadline:
+                name = names[number % len(names)]
+                number += 1
+                scenario = paths[name]
+                start = time.perf_counter()
+                try:
+                    status = await fetch(
+                        options['host'], options['port'], scenario.path,
+                        headers if scenario.authenticated else [],
+                        scenario.method, scenario.body)
+                except OSError:
+                    status = None
+                elapsed = (time.perf_counter() - start) * 1000
+                if status is None or status >= 400:
+                    errors[name] += 1
+                else:
+                    timings[name].append(elapsed)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            client(number) for number in range(options['concurrency'])))
+        elapsed = time.perf_counter() - start
+        every = [timing for values in timings.values() for timing in values]
+        if len(every) < 2:
+            raise CommandError('Сервер не ответил ни на один запрос')
+        return {
+            'requests': len(every),
+            'errors': sum(errors.values()),
+            'rps': round(len(every) / elapsed, 1),
+            'p50_ms': round(percentile(every, 50), 2),
+            'p95_ms': round(percentile(every, 95), 2),
+            'p99_ms': round(percentile(every, 99), 2),
+            'scenarios': {
+                name: {
+                    'requests': len(values),
+                    'errors': errors[name],
+                    'p50_ms': round(percentile(values, 50), 2),
+                    'p95_ms': round(percentile(values, 95), 2),
+                }
+                for name, values in timings.items() if len(values) > 1
+            },
+        }
+
+    def report(self, mode, result):
+        style = (self.style.WARNING if result['errors']
+                 else self.style.SUCCESS)
+        self.stdout.write(style(
+            f'{mode.upper():5} {result["requests"]:7} запросов '
+            f'{result["rps"]:8.1f} rps p50={result["p50_ms"]:8.2f} мс '
+            f'p95={result["p95_ms"]:8.2f} мс p99={result["p99_ms"]:8.2f} мс '
+            f'ошибок: {result["errors"]}'))
+        for name, scenario in result['scenarios'].items():
+            self.stdout.write(
+                f'      {name:26} p50={scenario["p50_ms"]:8.2f} мс '
+                f'p95={scenario["p95_ms"]:8.2f} мс '
+                f'ошибок: {scenario["errors"]}')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.shopping_list import check_shopping_lists
+
+# docker compose exec backend python manage.py check_shopping_lists --fix
+
+
+class Command(BaseCommand):
+    help = ('Сверка сводных списков покупок (ShoppingListItem) с рецептами '
+            'в корзинах')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Пересчитать списки с расхождениями')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = check_shopping_lists(fix=options['fix'])
+        for kind, total in drift.items():
+            style = self.style.WARNING if total else self.style.SUCCESS
+            self.stdout.write(style(f'{kind}: {total}'))
+        if options['fix'] and any(drift.values()):
+            self.stdout.write(self.style.SUCCESS('Списки покупок исправлены'))
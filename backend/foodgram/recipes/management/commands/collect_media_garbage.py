@@ -0,0 +1,65 @@
+import os
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from recipes.models import Recipe
+
+# docker compose exec backend python manage.py collect_media_garbage --dry-run
+
+
+def walk(storage, path):
+    """Имена всех файлов каталога хранилища, включая вложенные."""
+    if not storage.exists(path):
+        return
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield os.path.join(path, name)
+    for directory in directories:
+        yield from walk(storage, os.path.join(path, directory))
+
+
+def referenced_files():
+    """Картинки рецептов и их уменьшенные копии."""
+    referenced = set()
+    for image, variants in Recipe.objects.values_list(
+            'image', 'image_variants').iterator():
+        referenced.add(image)
+        for name in ('webp', 'jpeg'):
+            referenced.update((variants or {}).get(name, {}).values())
+    return referenced
+
+
+class Command(BaseCommand):
+    help = 'Удаление медиафайлов, на которые не ссылается ни один рецепт'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='recipes',
+                            help='Каталог в хранилище')
+        parser.add_argument('--min-age', type=int, default=3600,
+                            help='Не трогать файлы моложе стольких секунд: '
+                                 'их транзакция могла ещё не завершиться')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать, что будет удалено')
+
+    def handle(self, *args, **options):
+        # Ссылки собираются раньше списка файлов: файл, загруженный
+        # между двумя шагами, защищён порогом --min-age.
+        referenced = referenced_files()
+        deadline = time.time() - options['min_age']
+        removed = size = 0
+        for name in walk(default_storage, options['path']):
+            if name in referenced:
+                continue
+            if default_storage.get_modified_time(name).timestamp() > deadline:
+                continue
+            size += default_storage.size(name)
+            removed += 1
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                default_storage.delete(name)
+        action = 'Будет удалено' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} файлов: {removed}, {size / 1024 ** 2:.1f} МБ; '
+            f'используется: {len(referenced)}'))
@@ -0,0 +1,206 @@
+import random
+import time
+from io import BytesIO
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from PIL import Image
+from recipes.counters import recount
+from recipes.models import (FavoriteRecipe, Follow, Ingredient,
+                            IngredientAmount, Recipe, ShoppingCart, Tag, User)
+from recipes.shopping_list import check_shopping_lists
+from recipes.versions import bump_version
+
+# docker compose exec backend python manage.py generate_data \
+# --users 10000 --recipes 100000 --favorites 1000000
+
+IMAGE_NAME = 'recipes/generated.png'
+ADJECTIVES = ('Домашний', 'Быстрый', 'Праздничный', 'Летний', 'Острый',
+              'Бабушкин', 'Пряный', 'Лёгкий', 'Сытный', 'Весенний')
+DISHES = ('суп', 'салат', 'пирог', 'рагу', 'омлет', 'плов', 'соус',
+          'запеканка', 'паста', 'десерт')
+
+
+def zipf_cum_weights(size, exponent):
+    """Накопленные веса распределения Ципфа для рангов 1..size."""
+    return list(accumulate(1 / rank ** exponent
+                           for rank in range(1, size + 1)))
+
+
+class Command(BaseCommand):
+    help = ('Генерация синтетических данных для нагрузочного тестирования: '
+            'пользователи, рецепты, подписки, избранное и списки покупок')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=10000)
+        parser.add_argument('--follows', type=int, default=20000)
+        parser.add_argument('--favorites', type=int, default=100000)
+        parser.add_argument('--carts', type=int, default=10000)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8,
+                            help='Среднее число ингредиентов в рецепте')
+        parser.add_argument('--zipf', type=float, default=1.1,
+                            help='Показатель распределения Ципфа для '
+                                 'ингредиентов, авторов и рецептов')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='gen',
+                            help='Префикс имён создаваемых пользователей')
+        parser.add_argument('--password', default='generated-password')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.zipf = options['zipf']
+        ingredients = list(Ingredient.objects.order_by('pk')
+                           .values_list('pk', flat=True))
+        tags = list(Tag.objects.order_by('pk').values_list('pk', flat=True))
+        if not ingredients or not tags:
+            raise CommandError(
+                'Нет ингредиентов или тегов, сначала выполните '
+                'ingredient_import data/ingredients.csv data/tags-list.json')
+        # Ранги популярности перемешиваются, чтобы «популярными» не
+        # оказывались ингредиенты с начала алфавита.
+        self.rng.shuffle(ingredients)
+
+        users = self.stage('Пользователи', self.create_users, options)
+        recipes = self.stage('Рецепты', self.create_recipes, options,
+                             users, ingredients, tags)
+        self.stage('Подписки', self.create_pairs, Follow, 'following',
+                   users, users, options['follows'])
+        self.stage('Избранное', self.create_pairs, FavoriteRecipe, 'recipe',
+                   users, recipes, options['favorites'])
+        self.stage('Списки покупок', self.create_pairs, ShoppingCart,
+                   'recipe', users, recipes, options['carts'])
+        self.stage('Счётчики и сводные списки', self.recount)
+        bump_version('recipes')
+
+    def stage(self, title, function, *args):
+        start = time.perf_counter()
+        with transaction.atomic():
+            result = function(*args)
+        total = len(result) if result is not None else 0
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{title}: {total} за {elapsed:.1f} с'
+            + (f' ({total / elapsed:.0f} строк/с)' if total else '')))
+        return result
+
+    def bulk_create(self, model, objects, **kwargs):
+        return model.objects.bulk_create(
+            objects, batch_size=self.batch_size, **kwargs)
+
+    def insert_rows(self, model, columns, rows, ignore_conflicts=False):
+        """Многострочные INSERT из кортежей без создания объектов моделей.
+
+        Для сотен тысяч строк связей создание экземпляров и компиляция
+        запросов в bulk_create занимают больше времени, чем сама вставка.
+        """
+        quote = connection.ops.quote_name
+        size = min(self.batch_size,
+                   connection.ops.bulk_batch_size(columns, rows) or 1)
+        sql = (f'INSERT INTO {quote(model._meta.db_table)} '
+               f'({", ".join(map(quote, columns))}) VALUES ')
+        row_sql = f'({", ".join(["%s"] * len(columns))})'
+        suffix = ' ON CONFLICT DO NOTHING' if ignore_conflicts else ''
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), size):
+                batch = rows[start:start + size]
+                cursor.execute(
+                    sql + ', '.join([row_sql] * len(batch)) + suffix,
+                    [value for row in batch for value in row])
+
+    def create_users(self, options):
+        prefix = options['prefix']
+        password = make_password(options['password'])
+        self.bulk_create(User, [
+            User(username=f'{prefix}{number}',
+                 email=f'{prefix}{number}@example.com',
+                 first_name='Имя', last_name=f'Фамилия{number}',
+                 password=password)
+            for number in range(options['users'])
+        ], ignore_conflicts=True)
+        return list(User.objects.filter(
+            username__startswith=prefix).order_by('pk').values_list(
+            'pk', flat=True))[:options['users']]
+
+    def create_image(self):
+        # Хранилище само выбирает имя файла, поэтому используется
+        # возвращённое им.
+        buffer = BytesIO()
+        Image.new('RGB', (64, 64), (230, 108, 45)).save(buffer, 'PNG')
+        return default_storage.save(IMAGE_NAME, ContentFile(buffer.getvalue()))
+
+    def create_recipes(self, options, users, ingredients, tags):
+        image = self.create_image()
+        rng = self.rng
+        author_weights = zipf_cum_weights(len(users), self.zipf)
+        ingredient_weights = zipf_cum_weights(len(ingredients), self.zipf)
+        per_recipe = options['ingredients_per_recipe']
+        recipes = self.bulk_create(Recipe, [
+            Recipe(author_id=author,
+                   name=f'{rng.choice(ADJECTIVES)} {rng.choice(DISHES)} '
+                        f'№{number}',
+                   text='Сгенерированный рецепт для нагрузочного теста.',
+                   image=image,
+                   cooking_time=rng.randint(5, 180))
+            for number, author in enumerate(rng.choices(
+                users, cum_weights=author_weights, k=options['recipes']))
+        ])
+        amounts, recipe_tags = [], []
+        for recipe in recipes:
+            count = max(1, min(len(ingredients),
+                               round(rng.gauss(per_recipe, 2))))
+            chosen = set()
+            while len(chosen) < count:
+                chosen.update(rng.choices(
+                    ingredients, cum_weights=ingredient_weights,
+                    k=count - len(chosen)))
+            amounts.extend((recipe.pk, pk, rng.randint(1, 500))
+                           for pk in sorted(chosen))
+            recipe_tags.extend(
+                (recipe.pk, pk)
+                for pk in rng.sample(tags, rng.randint(1, min(3, len(tags)))))
+        self.insert_rows(IngredientAmount,
+                         ('recipe_id', 'ingredient_id', 'amount'), amounts)
+        self.insert_rows(Recipe.tags.through, ('recipe_id', 'tag_id'),
+                         recipe_tags)
+        return [recipe.pk for recipe in recipes]
+
+    def create_pairs(self, model, field, users, targets, total):
+        """Уникальные пары (пользователь, объект) с популярными объектами.
+
+        Пользователи выбираются равномерно, объекты - по Ципфу. Если
+        популярные пары исчерпаны и новые почти не находятся, генерация
+        останавливается раньше.
+        """
+        rng = self.rng
+        weights = zipf_cum_weights(len(targets), self.zipf)
+        total = min(total, len(users) * len(targets))
+        size = len(targets)
+        pairs = set()
+        while len(pairs) < total:
+            need = total - len(pairs)
+            before = len(pairs)
+            for user, target in zip(
+                    rng.choices(users, k=need),
+                    rng.choices(range(size), cum_weights=weights, k=need)):
+                if model is not Follow or user != targets[target]:
+                    pairs.add(user * size + target)
+            if len(pairs) - before < need // 100 + 1:
+                self.stdout.write(self.style.WARNING(
+                    f'{model.__name__}: создано {len(pairs)} из {total}'))
+                break
+        self.insert_rows(
+            model, ('user_id', model._meta.get_field(field).column),
+            [(pair // size, targets[pair % size]) for pair in sorted(pairs)],
+            ignore_conflicts=True)
+        return pairs
+
+    def recount(self):
+        recount(fix=True)
+        check_shopping_lists(fix=True)
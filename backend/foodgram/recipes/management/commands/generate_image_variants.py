@@ -0,0 +1,64 @@
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from PIL import UnidentifiedImageError
+from recipes.images import build_variants, save_variants, variants_actual
+from recipes.models import Recipe
+
+# docker compose exec backend python manage.py generate_image_variants
+
+
+def build(source):
+    try:
+        return build_variants(source)
+    finally:
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = ('Построение уменьшенных копий WebP и JPEG для картинок '
+            'рецептов, у которых их ещё нет')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Перестроить копии всех картинок')
+        parser.add_argument('--workers', type=int,
+                            default=settings.IMAGE_VARIANT_WORKERS,
+                            help='Число потоков перекодирования')
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        # Одну картинку могут использовать несколько рецептов, копии
+        # строятся для неё один раз.
+        sources = defaultdict(int)
+        for source, variants in Recipe.objects.exclude(image='').values_list(
+                'image', 'image_variants').iterator():
+            if options['all'] or not variants_actual(variants, source):
+                sources[source] += 1
+        if not sources:
+            self.stdout.write(self.style.SUCCESS('Все копии актуальны'))
+            return
+
+        built = failed = updated = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            futures = {executor.submit(build, source): source
+                       for source in sources}
+            for future in as_completed(futures):
+                source = futures[future]
+                try:
+                    variants = future.result()
+                except (OSError, UnidentifiedImageError) as error:
+                    failed += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'{source}: {error}'))
+                    continue
+                built += 1
+                updated += save_variants(source, variants)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'Картинок: {built} за {elapsed:.1f} с, рецептов обновлено: '
+            f'{updated}, ошибок: {failed}'))
@@ -1,32 +1,221 @@
 import csv
+import json
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from itertools import chain, islice
 
-from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from recipes.models import Ingredient, Tag, User
+from recipes.versions import bump_version
 
-# docker compose exec backend python manage.py  \
-# ingredient_import data/ingredients.csv
+# docker compose exec backend python manage.py ingredient_import \
+# data/ingredients.csv data/tags-list.json data/users-list.json
+
+CHUNK_SIZE = 64 * 1024
+# Пробелы и разделители между объектами.
+SEPARATORS = re.compile(r'[\s\[,\]]*')
+
+
+def iter_json(file):
+    """Объекты из JSON-массива или из подряд идущих JSON-объектов.
+
+    Файл читается частями, в памяти держится только текущий фрагмент.
+    """
+    decoder = json.JSONDecoder()
+    buffer, index, eof = '', 0, False
+    while True:
+        index = SEPARATORS.match(buffer, index).end()
+        try:
+            record, index = decoder.raw_decode(buffer, index)
+        except json.JSONDecodeError:
+            if eof:
+                if index < len(buffer):
+                    raise
+                return
+            chunk = file.read(CHUNK_SIZE)
+            eof = not chunk
+            # Разобранная часть отбрасывается один раз на прочитанный
+            # фрагмент, а не после каждого объекта.
+            buffer, index = buffer[index:] + chunk, 0
+            continue
+        yield record
+
+
+def iter_records(path):
+    with open(path, encoding='utf-8') as file:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(file, delimiter=',')
+        else:
+            yield from iter_json(file)
+
+
+def batches(records, size):
+    records = iter(records)
+    while batch := list(islice(records, size)):
+        yield batch
+
+
+class IngredientLoader:
+    model = Ingredient
+    fields = ('name', 'measurement_unit')
+    versions = ('ingredients',)
+
+    def rows(self, batch):
+        # Дубликаты внутри пачки схлопываются до вставки.
+        return list(dict.fromkeys(
+            tuple(record[field].strip() for field in self.fields)
+            for record in batch))
+
+    def save(self, rows):
+        # Все столбцы входят в уникальный ключ (name, measurement_unit),
+        # обновлять при конфликте нечего: upsert сводится к DO NOTHING.
+        self.model.objects.bulk_create(
+            [self.model(**dict(zip(self.fields, row))) for row in rows],
+            ignore_conflicts=True)
+
+    def copy(self, cursor, rows):
+        """COPY во временную таблицу и одна вставка из неё.
+
+        Во временной таблице только загружаемые столбцы: без id и его
+        DEFAULT nextval() строки COPY не расходуют значения
+        последовательности.
+        """
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = ', '.join(map(connection.ops.quote_name, self.fields))
+        buffer = StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.execute(
+            f'CREATE TEMPORARY TABLE IF NOT EXISTS ingredient_import '
+            f'ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA')
+        cursor.execute('TRUNCATE ingredient_import')
+        cursor.copy_expert(
+            f'COPY ingredient_import ({columns}) FROM STDIN WITH CSV',
+            buffer)
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}) '
+            f'SELECT DISTINCT {columns} FROM ingredient_import '
+            f'ON CONFLICT DO NOTHING')
+
+
+class TagLoader:
+    model = Tag
+    fields = ('name', 'color', 'slug')
+    versions = ('tags', 'recipes')
+    copy = None
+
+    def rows(self, batch):
+        return list({record['slug']: tuple(
+            record[field] for field in self.fields) for record in batch
+        }.values())
+
+    def save(self, rows):
+        self.model.objects.bulk_create(
+            [self.model(**dict(zip(self.fields, row))) for row in rows],
+            update_conflicts=True, unique_fields=['slug'],
+            update_fields=['name', 'color'])
+
+
+class UserLoader:
+    model = User
+    fields = ('email', 'username', 'first_name', 'last_name', 'password')
+    versions = ()
+    copy = None
+
+    def rows(self, batch):
+        return list({record['username']: tuple(
+            record[field] for field in self.fields) for record in batch
+        }.values())
+
+    def save(self, rows):
+        # Пароли хешируются только для новых пользователей: PBKDF2 на
+        # каждую строку - самая дорогая часть загрузки. hashlib отпускает
+        # GIL, поэтому хеши считаются параллельно.
+        existing = set(self.model.objects.filter(
+            username__in=[row[1] for row in rows]
+        ).values_list('username', flat=True))
+        rows = [row for row in rows if row[1] not in existing]
+        with ThreadPoolExecutor() as executor:
+            passwords = executor.map(make_password,
+                                     [row[-1] for row in rows])
+        self.model.objects.bulk_create(
+            [self.model(**dict(zip(self.fields, (*row[:-1], password))))
+             for row, password in zip(rows, passwords)],
+            ignore_conflicts=True)
+
+
+LOADERS = {
+    'ingredients': IngredientLoader,
+    'tags': TagLoader,
+    'users': UserLoader,
+}
+
+
+def detect_kind(record):
+    if 'measurement_unit' in record:
+        return 'ingredients'
+    if 'slug' in record:
+        return 'tags'
+    if 'username' in record:
+        return 'users'
+    raise CommandError(f'Не удалось определить тип записи: {record}')
 
 
 class Command(BaseCommand):
-    help = 'Загрузка данных из CSV файла в базу данных Django'
+    help = ('Пакетная загрузка ингредиентов, тегов и пользователей из CSV '
+            'и JSON в базу данных Django')
 
     def add_arguments(self, parser):
-        parser.add_argument('csv_file', help='foodgram.data.ingridients.csv')
+        parser.add_argument('files', nargs='+',
+                            help='data/ingredients.csv, '
+                                 'data/ingredients_j.json, '
+                                 'data/tags-list.json, data/users-list.json')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Строк в одной пачке')
+        parser.add_argument('--kind', choices=LOADERS,
+                            help='Тип записей; по умолчанию определяется '
+                                 'по первой записи файла')
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Не использовать COPY на PostgreSQL')
 
     def handle(self, *args, **options):
-        csv_file = options['csv_file']
+        for path in options['files']:
+            try:
+                self.load(path, options)
+            except (OSError, KeyError, ValueError) as error:
+                raise CommandError(f'{path}: {error!r}')
 
-        try:
-            with open(csv_file, 'r') as file:
-                reader = csv.DictReader(file, delimiter=',')
-                for row in reader:
-                    your_model_instance = Ingredient(
-                        name=row['name'],
-                        measurement_unit=row['measurement_unit'],
-                    )
-                    your_model_instance.save()
-
-                self.stdout.write(self.style.SUCCESS(
-                    'Данные успешно загружены в базу данных'))
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f'Произошла ошибка: {str(e)}'))
+    @transaction.atomic
+    def load(self, path, options):
+        start = time.perf_counter()
+        records = iter_records(path)
+        first = next(records, None)
+        if first is None:
+            self.stdout.write(self.style.WARNING(f'{path}: файл пуст'))
+            return
+        loader = LOADERS[options['kind'] or detect_kind(first)]()
+        use_copy = (loader.copy is not None and not options['no_copy']
+                    and connection.vendor == 'postgresql')
+        before = loader.model.objects.count()
+        total = 0
+        with connection.cursor() as cursor:
+            for batch in batches(chain([first], records),
+                                 options['batch_size']):
+                rows = loader.rows(batch)
+                if use_copy:
+                    loader.copy(cursor, rows)
+                else:
+                    loader.save(rows)
+                total += len(batch)
+        created = loader.model.objects.count() - before
+        if loader.versions:
+            bump_version(*loader.versions)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f'{path}: {loader.model._meta.verbose_name_plural} - '
+            f'прочитано {total}, добавлено {created}, '
+            f'{total / elapsed:.0f} строк/с'))
@@ -0,0 +1,67 @@
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from recipes.models import Ingredient
+from recipes.search import ingredient_index, search_ingredients
+
+# docker compose exec backend python manage.py ingredient_search_benchmark
+
+
+class Command(BaseCommand):
+    help = ('Сравнение автодополнения ингредиентов: ORM istartswith '
+            'и индекс в памяти')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='Повторов для каждого префикса')
+        parser.add_argument('--limit', type=int,
+                            default=settings.INGREDIENT_SEARCH_LIMIT)
+        parser.add_argument('--search', action='store_true',
+                            help='Замерить нечёткий поиск (?search=) '
+                                 'вместо автодополнения')
+        parser.add_argument('prefixes', nargs='*',
+                            help='Префиксы; по умолчанию 1-3 первые буквы '
+                                 'названий из каталога')
+
+    def handle(self, *args, **options):
+        prefixes = options['prefixes'] or self.default_prefixes()
+        if not prefixes:
+            self.stdout.write(self.style.ERROR(
+                'Каталог ингредиентов пуст, загрузите ingredient_import'))
+            return
+        limit = options['limit']
+        ingredient_index.refresh()
+
+        def orm(prefix):
+            return list(Ingredient.objects.filter(
+                name__istartswith=prefix)[:limit])
+
+        def index(prefix):
+            return ingredient_index.search(prefix, limit)
+
+        def fuzzy(query):
+            return search_ingredients(query, limit)
+
+        paths = (('orm', orm), ('index', index))
+        if options['search']:
+            paths = (('search', fuzzy),)
+        for name, search in paths:
+            timings = []
+            for _ in range(options['repeat']):
+                for prefix in prefixes:
+                    start = time.perf_counter()
+                    search(prefix)
+                    timings.append((time.perf_counter() - start) * 1e6)
+            timings.sort()
+            self.stdout.write(
+                f'{name:>6}: {len(timings)} запросов, '
+                f'p50={statistics.median(timings):.1f} мкс, '
+                f'p99={timings[int(len(timings) * 0.99) - 1]:.1f} мкс, '
+                f'max={timings[-1]:.1f} мкс')
+
+    def default_prefixes(self):
+        names = Ingredient.objects.values_list('name', flat=True)[:200]
+        return sorted({name[:length] for name in names
+                       for length in (1, 2, 3) if name[:length]})
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.counters import recount
+
+# docker compose exec backend python manage.py recount_counters
+
+
+class Command(BaseCommand):
+    help = ('Пересчёт счётчиков рецептов автора, избранного и списков '
+            'покупок с исправлением расхождений')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            drift = recount(fix=not options['dry_run'])
+        for counter, total in drift.items():
+            style = self.style.WARNING if total else self.style.SUCCESS
+            self.stdout.write(style(f'{counter}: расхождений {total}'))
+        if not options['dry_run'] and any(drift.values()):
+            self.stdout.write(self.style.SUCCESS('Счётчики исправлены'))
@@ -0,0 +1,58 @@
+# Generated by Django 4.2.5 on 2026-10-18 05:33
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('pg_catalog.russian', "
+    "coalesce({table}.name, '')), 'A') || "
+    "setweight(to_tsvector('pg_catalog.russian', "
+    "coalesce({table}.text, '')), 'B')"
+)
+
+
+def create_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE OR REPLACE FUNCTION recipes_recipe_search_vector_update() '
+        'RETURNS trigger AS $$ BEGIN '
+        f'NEW.search_vector := {SEARCH_VECTOR.format(table="NEW")}; '
+        'RETURN NEW; END $$ LANGUAGE plpgsql')
+    schema_editor.execute(
+        'CREATE TRIGGER recipes_recipe_search_vector_trigger '
+        'BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe '
+        'FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_vector_update()')
+    schema_editor.execute(
+        'UPDATE recipes_recipe SET search_vector = '
+        + SEARCH_VECTOR.format(table='recipes_recipe'))
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipe_search_vector_idx '
+        'ON recipes_recipe USING gin (search_vector)')
+
+
+def drop_search_trigger(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipe_search_vector_idx')
+    schema_editor.execute(
+        'DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger '
+        'ON recipes_recipe')
+    schema_editor.execute(
+        'DROP FUNCTION IF EXISTS recipes_recipe_search_vector_update()')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_ingredient_trigram_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, help_text='Заполняется триггером базы данных', null=True),
+        ),
+        migrations.RunPython(create_search_trigger, drop_search_trigger),
+    ]
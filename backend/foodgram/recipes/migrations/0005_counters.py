@@ -0,0 +1,47 @@
+# Generated by Django 4.2.5 on 2026-10-18 05:34
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('Recipe', 'author', 'User', 'recipes_count'),
+    ('FavoriteRecipe', 'recipe', 'Recipe', 'favorites_count'),
+    ('ShoppingCart', 'recipe', 'Recipe', 'shopping_cart_count'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for source, foreign_key, model, field in COUNTERS:
+        source = apps.get_model('recipes', source)
+        apps.get_model('recipes', model).objects.update(**{field: Coalesce(
+            Subquery(source.objects.filter(**{foreign_key: OuterRef('pk')})
+                     .order_by().values(foreign_key)
+                     .annotate(total=Count('pk')).values('total')),
+            0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
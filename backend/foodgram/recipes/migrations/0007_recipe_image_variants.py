@@ -0,0 +1,18 @@
+# Generated by Django 4.2.5 on 2026-10-18 05:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_shopping_list_item'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Заполняется в фоне после сохранения картинки', verbose_name='Уменьшенные копии картинки'),
+        ),
+    ]
@@ -1,12 +1,44 @@
+import logging
+from collections import Counter, defaultdict
+
 from colorfield.fields import ColorField
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField)
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models import (Case, Exists, F, OuterRef, Prefetch, Q, Sum,
+                              Value, When, Window)
+from django.db.models.functions import RowNumber
 
 from .validators import validate_username
+from .versions import bump_version
+
+logger = logging.getLogger(__name__)
+
+
+class CounterFieldsMixin:
+    """Не записывает счётчики при обычном save() существующей строки.
 
+    Счётчики меняются только через F() в recipes.counters. Полный save()
+    записал бы значения, прочитанные в начале запроса, и затёр бы
+    параллельные увеличения.
+    """
+    counter_fields = ()
 
-class User(AbstractUser):
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if (update_fields is None and not force_insert
+                and not self._state.adding):
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.counter_fields]
+        super().save(force_insert=force_insert, force_update=force_update,
+                     using=using, update_fields=update_fields)
+
+
+class User(CounterFieldsMixin, AbstractUser):
 
     email = models.EmailField(
         max_length=254,
@@ -25,6 +57,13 @@ class User(AbstractUser):
         'Фамилия',
         max_length=150,
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
+
+    counter_fields = ('recipes_count',)
 
     class Meta:
         ordering = ('username',)
@@ -58,7 +97,80 @@ class Ingredient(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+def annotate_is_subscribed(queryset, user):
+    """Помечает авторов, на которых подписан пользователь."""
+    if user.is_anonymous:
+        return queryset.annotate(is_subscribed=Value(False))
+    return queryset.annotate(is_subscribed=Exists(
+        Follow.objects.filter(user=user, following=OuterRef('pk'))))
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    def search(self, text):
+        """Полнотекстовый поиск по названию и описанию с ранжированием.
+
+        На PostgreSQL используется search_vector (русская морфология,
+        название весомее описания), на остальных базах - поиск подстроки.
+        """
+        if connections[self.db].vendor == 'postgresql':
+            query = SearchQuery(text, config='russian',
+                                search_type='websearch')
+            queryset = self.filter(search_vector=query).annotate(
+                rank=SearchRank(F('search_vector'), query))
+        else:
+            queryset = self.filter(
+                Q(name__icontains=text) | Q(text__icontains=text)
+            ).annotate(rank=Case(When(name__icontains=text, then=Value(1.0)),
+                                 default=Value(0.5)))
+        return queryset.order_by('-rank', *Recipe._meta.ordering)
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            return self.annotate(is_favorited=Value(False),
+                                 is_in_shopping_cart=Value(False))
+        return self.annotate(
+            is_favorited=Exists(FavoriteRecipe.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
+    def latest_by_author(self, author_ids, limit=None):
+        """Последние рецепты авторов одним запросом: {author_id: [...]}.
+
+        Ограничение на автора применяется через ROW_NUMBER() OVER
+        (PARTITION BY author), если база поддерживает оконные функции,
+        иначе рецепты отсекаются в Python.
+        """
+        queryset = self.filter(author__in=author_ids)
+        if (limit is not None
+                and connections[self.db].features.supports_over_clause):
+            queryset = queryset.annotate(row_number=Window(
+                RowNumber(),
+                partition_by=F('author'),
+                order_by=[F('pub_date').desc(), F('id').desc()],
+            )).filter(row_number__lte=limit)
+        recipes = defaultdict(list)
+        for recipe in queryset.order_by('author', *Recipe._meta.ordering):
+            if limit is None or len(recipes[recipe.author_id]) < limit:
+                recipes[recipe.author_id].append(recipe)
+        return recipes
+
+    def for_read(self, user):
+        """Рецепты со всеми связями для RecipeSerializer."""
+        return self.with_user_flags(user).prefetch_related(
+            'tags',
+            Prefetch('ingredientamount_set',
+                     queryset=IngredientAmount.objects.select_related(
+                         'ingredient')),
+            Prefetch('author',
+                     queryset=annotate_is_subscribed(User.objects.all(),
+                                                     user)),
+        )
+
+
+class Recipe(CounterFieldsMixin, models.Model):
     """Модель для Recipes"""
     name = models.CharField(max_length=200, verbose_name='Название рецепта')
     text = models.TextField(
@@ -88,10 +200,46 @@ class Recipe(models.Model):
         upload_to='recipes/',
         help_text="Загрузить изображение",
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False,
+        help_text='Заполняется в фоне после сохранения картинки',
+    )
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления (минут)',
         validators=[MinValueValidator(
             limit_value=1, message='Невозможно приготовить за 0 минут!'), ])
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+        auto_now_add=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        help_text='Заполняется триггером базы данных',
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    counter_fields = ('favorites_count', 'shopping_cart_count')
+
+    class Meta:
+        ordering = ('-pub_date', '-id')
+        indexes = [
+            models.Index(fields=['-pub_date', '-id'],
+                         name='recipe_pub_date_id_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -119,6 +267,24 @@ class IngredientAmount(models.Model):
                                     name='unique_ingredient_in_recipe')
         ]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_loaded()
+        return instance
+
+    def remember_loaded(self):
+        """Запоминает строку, прочитанную из базы или только что записанную.
+
+        Сигналы переносят изменение строки в списки покупок как разницу
+        с этими значениями.
+        """
+        self.loaded = (self.__dict__.get('recipe_id'),
+                       self.__dict__.get('ingredient_id'),
+                       self.__dict__.get('amount'))
+        if None in self.loaded:
+            self.loaded = None
+
 
 class FavoriteRecipe(models.Model):
     user = models.ForeignKey(
@@ -187,3 +353,165 @@ class ShoppingCart(models.Model):
             models.UniqueConstraint(fields=['user', 'recipe'],
                                     name='unique_shopping_cart')
         ]
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+
+    def actual(self, users=None, ingredients=None):
+        """Суммы по рецептам в корзинах: {(user_id, ingredient_id): amount}."""
+        # Условия на корзину задаются одним filter(): каждый вызов filter()
+        # по связи многие-к-одному добавил бы ещё один JOIN и задвоил суммы.
+        lookups = {'recipe__shopping_cart__user__isnull': False}
+        if users is not None:
+            lookups['recipe__shopping_cart__user__in'] = users
+        if ingredients is not None:
+            lookups['ingredient__in'] = ingredients
+        amounts = IngredientAmount.objects.filter(**lookups)
+        return {
+            (user, ingredient): total
+            for user, ingredient, total in amounts.values_list(
+                'recipe__shopping_cart__user', 'ingredient'
+            ).annotate(total=Sum('amount')).order_by()
+        }
+
+    def apply_deltas(self, deltas):
+        """Прибавляет к строкам списков {(user, ingredient): разница}.
+
+        Недостающие строки вставляются с нулём (ON CONFLICT DO NOTHING),
+        затем все суммы сдвигаются одним UPDATE через F(), поэтому
+        параллельные изменения складываются, а не затирают друг друга.
+        Строки, которые дошли бы до нуля, удаляются до UPDATE. Уход
+        ниже нуля означает расхождение списка с корзинами: он пишется
+        в журнал (исправляет check_shopping_lists). Версии cart:<user>
+        затронутых пользователей увеличиваются.
+        """
+        deltas = {key: delta for key, delta in deltas.items() if delta}
+        if not deltas:
+            return
+        self.bulk_create(
+            [ShoppingListItem(user_id=user, ingredient_id=ingredient,
+                              amount=0)
+             for (user, ingredient), delta in deltas.items() if delta > 0],
+            ignore_conflicts=True)
+        rows = self.filter(user__in={user for user, _ in deltas},
+                           ingredient__in={ingredient
+                                           for _, ingredient in deltas})
+        total = F('amount') + Case(
+            *(When(user=user, ingredient=ingredient, then=Value(delta))
+              for (user, ingredient), delta in deltas.items()),
+            default=Value(0))
+        if any(delta < 0 for delta in deltas.values()):
+            emptied = rows.alias(total=total).filter(total__lte=0)
+            drifted = [
+                (user, ingredient, amount)
+                for user, ingredient, amount in emptied.annotate(
+                    total=total).values_list('user', 'ingredient', 'total')
+                if amount < 0]
+            if drifted:
+                logger.warning('Списки покупок разошлись с корзинами '
+                               '(пользователь, ингредиент, сумма): %s',
+                               drifted)
+            emptied.delete()
+        rows.update(amount=total)
+        bump_version(*{f'cart:{user}' for user, _ in deltas})
+
+    def carts_changed(self, added=(), removed=()):
+        """Переносит в списки рецепты, добавленные в корзины и удалённые.
+
+        added и removed - пары (user_id, recipe_id). Количества рецептов
+        читаются одним запросом.
+        """
+        recipes = {recipe for _, recipe in (*added, *removed)}
+        if not recipes:
+            return
+        amounts = defaultdict(list)
+        for recipe, ingredient, amount in IngredientAmount.objects.filter(
+                recipe__in=recipes).values_list(
+                'recipe', 'ingredient', 'amount'):
+            amounts[recipe].append((ingredient, amount))
+        deltas = Counter()
+        for sign, carts in ((1, added), (-1, removed)):
+            for user, recipe in carts:
+                for ingredient, amount in amounts[recipe]:
+                    deltas[user, ingredient] += sign * amount
+        self.apply_deltas(deltas)
+
+    def recipes_changed(self, changes):
+        """Переносит в списки изменение ингредиентов рецептов.
+
+        changes - {(recipe_id, ingredient_id): разница количества}.
+        Затрагиваются только пользователи, у которых рецепт в корзине.
+        """
+        changes = {key: delta for key, delta in changes.items() if delta}
+        if not changes:
+            return
+        users = defaultdict(list)
+        for recipe, user in ShoppingCart.objects.filter(
+                recipe__in={recipe for recipe, _ in changes}).values_list(
+                'recipe', 'user'):
+            users[recipe].append(user)
+        deltas = Counter()
+        for (recipe, ingredient), delta in changes.items():
+            for user in users[recipe]:
+                deltas[user, ingredient] += delta
+        self.apply_deltas(deltas)
+
+    def refresh(self, users, ingredients=None):
+        """Пересчитывает строки списков покупок пользователей заново.
+
+        Нужен для исправления расхождений (check_shopping_lists); при
+        обычной работе списки сдвигаются на разницу (apply_deltas).
+        Если переданы ингредиенты, пересчитываются только их строки.
+        Изменённые суммы записываются одним upsert, строки без рецептов
+        в корзине удаляются, версии cart:<user> изменённых списков
+        увеличиваются.
+        """
+        actual = self.actual(users, ingredients)
+        stored = self.filter(user__in=users)
+        if ingredients is not None:
+            stored = stored.filter(ingredient__in=ingredients)
+        current = {
+            (user, ingredient): (pk, amount)
+            for pk, user, ingredient, amount in stored.values_list(
+                'pk', 'user', 'ingredient', 'amount')
+        }
+        removed = [key for key in current if key not in actual]
+        changed = [
+            ShoppingListItem(user_id=user, ingredient_id=ingredient,
+                             amount=amount)
+            for (user, ingredient), amount in actual.items()
+            if current.get((user, ingredient), (None, None))[1] != amount
+        ]
+        if removed:
+            self.filter(pk__in=[current[key][0] for key in removed]).delete()
+        if changed:
+            self.bulk_create(
+                changed, update_conflicts=True,
+                unique_fields=['user', 'ingredient'],
+                update_fields=['amount'])
+        bump_version(*{f'cart:{user}' for user, _ in removed},
+                     *{f'cart:{item.user_id}' for item in changed})
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента по всем рецептам в списке покупок пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Ингредиент',
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'ingredient'],
+                                    name='unique_shopping_list_item')
+        ]
@@ -0,0 +1,184 @@
+"""Связи пользователя: избранное, список покупок и подписки."""
+from django.db import connections, transaction
+
+from .counters import update_counters
+from .models import (FavoriteRecipe, Follow, IngredientAmount, ShoppingCart,
+                     ShoppingListItem, User)
+from .versions import bump_version
+
+# модель связи: (поле с объектом связи, имя версии пользователя)
+RELATIONS = {
+    FavoriteRecipe: ('recipe', 'favorites'),
+    ShoppingCart: ('recipe', 'cart'),
+    Follow: ('following', 'follows'),
+}
+
+ADDED = 'added'
+EXISTS = 'exists'
+REMOVED = 'removed'
+MISSING = 'missing'
+NOT_FOUND = 'not_found'
+INVALID = 'invalid'
+
+
+def relations_changed(sender, added=(), removed=()):
+    """Счётчики, версии и списки покупок после изменения связей."""
+    if not added and not removed:
+        return
+    _, version = RELATIONS[sender]
+    users = {instance.user_id for instance in (*added, *removed)}
+    update_counters(sender, added, 1)
+    update_counters(sender, removed, -1)
+    bump_version(*(f'{version}:{user}' for user in users))
+    if sender is ShoppingCart:
+        ShoppingListItem.objects.carts_changed(
+            [(instance.user_id, instance.recipe_id) for instance in added],
+            [(instance.user_id, instance.recipe_id) for instance in removed])
+
+
+def relation_columns(model):
+    field = model._meta.get_field(RELATIONS[model][0])
+    return (model._meta.get_field('user').column, field.column,
+            field.related_model)
+
+
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def insert_relations(model, user, pks):
+    """Добавляет связи одним INSERT ... ON CONFLICT DO NOTHING RETURNING.
+
+    Строка вставляется, только если объект связи существует и связи ещё
+    нет, поэтому повторный или параллельный запрос не падает на
+    ограничении уникальности. Возвращает id объектов действительно
+    созданных связей.
+    """
+    user_column, column, target = relation_columns(model)
+    connection = connections[model.objects.db]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(model._meta.db_table)} '
+            f'({quote(user_column)}, {quote(column)}) '
+            f'SELECT %s, {quote(target._meta.pk.column)} '
+            f'FROM {quote(target._meta.db_table)} '
+            f'WHERE {quote(target._meta.pk.column)} IN ({placeholders(pks)}) '
+            f'ON CONFLICT DO NOTHING RETURNING {quote(column)}',
+            [user.pk, *pks])
+        return {pk for pk, in cursor.fetchall()}
+
+
+def delete_rows(model, returning, **filters):
+    """Удаляет строки одним DELETE ... RETURNING, без выборки и сигналов.
+
+    filters - {поле: значение или список значений}, returning - поля,
+    значения которых возвращаются по каждой удалённой строке.
+    """
+    connection = connections[model.objects.db]
+    quote = connection.ops.quote_name
+    conditions, params = [], []
+    for name, value in filters.items():
+        column = quote(model._meta.get_field(name).column)
+        if isinstance(value, (list, tuple, set)):
+            conditions.append(f'{column} IN ({placeholders(value)})')
+            params.extend(value)
+        else:
+            conditions.append(f'{column} = %s')
+            params.append(value)
+    columns = ', '.join(quote(model._meta.get_field(name).column)
+                        for name in returning)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {quote(model._meta.db_table)} '
+            f'WHERE {" AND ".join(conditions)} RETURNING {columns}',
+            params)
+        return cursor.fetchall()
+
+
+def delete_relations(model, user, pks):
+    """Удаляет связи пользователя, возвращает id удалённых объектов связи."""
+    field, _ = RELATIONS[model]
+    return {pk for pk, in delete_rows(
+        model, [field], user=user.pk, **{field: list(pks)})}
+
+
+def relation_instances(model, user, pks):
+    _, column, _ = relation_columns(model)
+    return [model(user=user, **{column: pk}) for pk in pks]
+
+
+@transaction.atomic
+def apply_batch(model, user, add=(), remove=()):
+    """Добавляет и удаляет связи пользователя пакетом.
+
+    Возвращает статус по каждому id: {'add': {id: ...}, 'remove': {...}}.
+    Статусы, счётчики и списки покупок строятся по строкам, которые
+    вставил и удалил сам запрос, а не по прочитанному заранее состоянию,
+    поэтому параллельные запросы их не искажают. Число запросов не
+    зависит от размера пакета.
+    """
+    field, _ = RELATIONS[model]
+    target = model._meta.get_field(field).related_model
+    add, remove = list(dict.fromkeys(add)), list(dict.fromkeys(remove))
+    found = set(target.objects.filter(
+        pk__in=add + remove).order_by().values_list('pk', flat=True))
+    insert = [pk for pk in add if pk in found
+              and not (target is User and pk == user.pk)]
+    delete = [pk for pk in remove if pk in found]
+    added = insert_relations(model, user, insert) if insert else set()
+    removed = delete_relations(model, user, delete) if delete else set()
+    results = {'add': {}, 'remove': {}}
+    for pk in add:
+        if pk not in found:
+            results['add'][pk] = NOT_FOUND
+        elif target is User and pk == user.pk:
+            results['add'][pk] = INVALID
+        else:
+            results['add'][pk] = ADDED if pk in added else EXISTS
+    for pk in remove:
+        if pk not in found:
+            results['remove'][pk] = NOT_FOUND
+        else:
+            results['remove'][pk] = REMOVED if pk in removed else MISSING
+    relations_changed(model, relation_instances(model, user, added),
+                      relation_instances(model, user, removed))
+    return results
+
+
+@transaction.atomic
+def add_relation(model, user, pk):
+    """Добавляет связь, возвращает True, если она создана."""
+    added = insert_relations(model, user, [pk])
+    if added:
+        relations_changed(
+            model, added=relation_instances(model, user, added))
+    return bool(added)
+
+
+@transaction.atomic
+def remove_relation(model, user, pk):
+    """Удаляет связь, возвращает True, если она была."""
+    removed = delete_relations(model, user, [pk])
+    if removed:
+        relations_changed(
+            model, removed=relation_instances(model, user, removed))
+    return bool(removed)
+
+
+@transaction.atomic
+def delete_recipe(recipe):
+    """Удаляет рецепт, снимая его связи пакетом.
+
+    При каскадном удалении сигналы отправляются на каждую строку
+    избранного, списков покупок и ингредиентов, и число запросов растёт с
+    популярностью рецепта. Здесь эти строки удаляются заранее одним DELETE
+    на таблицу, а счётчики, версии и списки покупок обновляются один раз.
+    Списки покупок уменьшаются, пока ингредиенты рецепта ещё в базе.
+    """
+    for model in (FavoriteRecipe, ShoppingCart):
+        users = delete_rows(model, ['user'], recipe=recipe.pk)
+        relations_changed(model, removed=[
+            model(user_id=user, recipe=recipe) for user, in users])
+    delete_rows(IngredientAmount, ['id'], recipe=recipe.pk)
+    recipe.delete()
@@ -0,0 +1,264 @@
+"""Поиск ингредиентов: автодополнение и нечёткий поиск.
+
+Каталог ингредиентов небольшой и меняется редко, поэтому он держится в
+памяти процесса и перестраивается, когда меняется версия 'ingredients'.
+Нечёткий поиск на PostgreSQL с расширением pg_trgm отбирает кандидатов
+по GIN-индексу, на остальных базах - по индексу триграмм в памяти.
+Ранжируются кандидаты одинаково на обоих путях (fuzzy_score).
+"""
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .models import Ingredient
+from .versions import get_version
+
+PREFIX, SUBSTRING, FUZZY = range(3)
+
+
+def split_words(text):
+    return re.findall(r'\w+', text.casefold())
+
+
+def trigrams(word):
+    """Триграммы слова в том же виде, что и у pg_trgm."""
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def levenshtein(first, second):
+    """Расстояние Левенштейна, битово-параллельный алгоритм Майерса."""
+    if not first or not second:
+        return len(first) + len(second)
+    masks = {}
+    for position, char in enumerate(first):
+        masks[char] = masks.get(char, 0) | 1 << position
+    full = (1 << len(first)) - 1
+    last = 1 << (len(first) - 1)
+    positive, negative, distance = full, 0, len(first)
+    for char in second:
+        equal = masks.get(char, 0)
+        vertical = equal | negative
+        horizontal = (((equal & positive) + positive) ^ positive) | equal
+        horizontal_positive = negative | ~(horizontal | positive) & full
+        horizontal_negative = positive & horizontal
+        if horizontal_positive & last:
+            distance += 1
+        elif horizontal_negative & last:
+            distance -= 1
+        horizontal_positive = (horizontal_positive << 1 | 1) & full
+        horizontal_negative = horizontal_negative << 1 & full
+        positive = (horizontal_negative
+                    | ~(vertical | horizontal_positive) & full)
+        negative = horizontal_positive & vertical
+    return distance
+
+
+def word_similarity(first, second):
+    return 1 - levenshtein(first, second) / max(len(first), len(second))
+
+
+def trigram_similarity(first, second):
+    """Сходство множеств триграмм, как similarity() в pg_trgm."""
+    return len(first & second) / len(first | second)
+
+
+class EditSimilarity:
+    """Близость названия к запросу по редакционному расстоянию.
+
+    Каждое слово запроса сравнивается с лучшим из переданных слов
+    названия, оценки усредняются. Расстояния запоминаются по словам: в
+    каталоге много названий с общими словами.
+    """
+
+    def __init__(self, query):
+        self.query_words = split_words(query)
+        self.cache = {}
+
+    def word(self, word):
+        if word not in self.cache:
+            self.cache[word] = [word_similarity(query_word, word)
+                                for query_word in self.query_words]
+        return self.cache[word]
+
+    def __call__(self, words):
+        scores = [self.word(word) for word in words]
+        if not scores or not self.query_words:
+            return 0
+        return sum(map(max, zip(*scores))) / len(self.query_words)
+
+
+def fuzzy_score(edit_similarity, matched):
+    """Оценка нечёткого совпадения по совпавшим словам названия.
+
+    matched - {слово: сходство триграмм с запросом} для слов, прошедших
+    порог. Оценка - пара из редакционной близости этих слов и лучшего
+    сходства их триграмм.
+    """
+    return edit_similarity(matched), max(matched.values())
+
+
+class IngredientIndex:
+    """Индекс каталога ингредиентов в памяти процесса.
+
+    Хранит отсортированные названия в нижнем регистре для поиска по
+    префиксу и обратный индекс триграмм слов для нечёткого поиска.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = (None, [], [], {}, {})
+
+    def refresh(self):
+        version = get_version('ingredients')
+        if self._snapshot[0] == version:
+            return self._snapshot
+        with self._lock:
+            if self._snapshot[0] != version:
+                self._snapshot = (version, *self.build())
+        return self._snapshot
+
+    def build(self):
+        ingredients = sorted(
+            Ingredient.objects.all(),
+            key=lambda ingredient: (ingredient.name.casefold(),
+                                    ingredient.pk))
+        keys = [ingredient.name.casefold() for ingredient in ingredients]
+        positions = defaultdict(list)
+        for position, key in enumerate(keys):
+            for word in set(split_words(key)):
+                positions[word].append(position)
+        words = {word: (trigrams(word), word_positions)
+                 for word, word_positions in positions.items()}
+        postings = defaultdict(set)
+        for word, (word_trigrams, _) in words.items():
+            for trigram in word_trigrams:
+                postings[trigram].add(word)
+        return keys, ingredients, words, dict(postings)
+
+    def search(self, prefix, limit):
+        _, keys, ingredients, _, _ = self.refresh()
+        prefix = prefix.casefold()
+        result = []
+        position = bisect_left(keys, prefix)
+        while (position < len(keys) and len(result) < limit
+               and keys[position].startswith(prefix)):
+            result.append(ingredients[position])
+            position += 1
+        return result
+
+    def fuzzy_search(self, query, threshold):
+        """Кандидаты с рангом: префикс, подстрока, затем похожие слова."""
+        _, keys, ingredients, words, postings = self.refresh()
+        edit_similarity = EditSimilarity(query)
+        query = query.casefold()
+        query_trigrams = set().union(
+            *(trigrams(word) for word in split_words(query)))
+        ranked = {}
+        for position, key in enumerate(keys):
+            if query in key:
+                ranked[position] = (PREFIX if key.startswith(query)
+                                    else SUBSTRING, None)
+        candidates = set().union(
+            *(postings.get(trigram, ()) for trigram in query_trigrams))
+        for word in candidates:
+            word_trigrams, word_positions = words[word]
+            similarity = trigram_similarity(query_trigrams, word_trigrams)
+            if similarity < threshold:
+                continue
+            for position in word_positions:
+                rank, matched = ranked.get(position, (FUZZY, {}))
+                if rank == FUZZY:
+                    matched[word] = similarity
+                    ranked[position] = (rank, matched)
+        return [(ingredients[position], rank,
+                 fuzzy_score(edit_similarity, matched)
+                 if rank == FUZZY else None)
+                for position, (rank, matched) in ranked.items()]
+
+
+ingredient_index = IngredientIndex()
+
+
+def trigram_extension_installed():
+    """Установлено ли pg_trgm; ответ запоминается для соединения.
+
+    Расширение, установленное позже, заметят новые соединения.
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    connection.ensure_connection()
+    checked = getattr(connection, 'trigram_extension', None)
+    if checked is not None and checked[0] is connection.connection:
+        return checked[1]
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        installed = cursor.fetchone() is not None
+    connection.trigram_extension = (connection.connection, installed)
+    return installed
+
+
+def trigram_candidates(query, threshold):
+    """Кандидаты из PostgreSQL по GIN-индексам триграмм.
+
+    Индекс отбирает названия с word_similarity не ниже порога, а оценка
+    считается по словам названия так же, как в индексе в памяти.
+    Кандидаты, у которых ни одно слово не прошло порог, отбрасываются.
+    """
+    edit_similarity = EditSimilarity(query)
+    query_trigrams = set().union(
+        *(trigrams(word) for word in split_words(query)))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('SET LOCAL pg_trgm.word_similarity_threshold = %s',
+                       [threshold])
+        candidates = Ingredient.objects.filter(
+            Q(name__icontains=query) | Q(name__trigram_word_similar=query))
+        result = []
+        for ingredient in candidates:
+            key = ingredient.name.casefold()
+            if key.startswith(query.casefold()):
+                result.append((ingredient, PREFIX, None))
+            elif query.casefold() in key:
+                result.append((ingredient, SUBSTRING, None))
+            else:
+                matched = {}
+                for word in split_words(key):
+                    similarity = trigram_similarity(query_trigrams,
+                                                    trigrams(word))
+                    if similarity >= threshold:
+                        matched[word] = similarity
+                if matched:
+                    result.append((ingredient, FUZZY, fuzzy_score(
+                        edit_similarity, matched)))
+        return result
+
+
+def search_ingredients(query, limit):
+    """Ранжированный поиск: префикс > подстрока > нечёткое совпадение.
+
+    Префиксы и подстроки упорядочены по названию, нечёткие совпадения -
+    по редакционному расстоянию до слов названия, затем по сходству
+    триграмм.
+    """
+    query = query.strip()
+    if not query:
+        return []
+    threshold = settings.INGREDIENT_FUZZY_THRESHOLD
+    if trigram_extension_installed():
+        candidates = trigram_candidates(query, threshold)
+    else:
+        candidates = ingredient_index.fuzzy_search(query, threshold)
+
+    def order(candidate):
+        ingredient, rank, score = candidate
+        if rank == FUZZY:
+            return (rank, -score[0], -score[1], ingredient.name.casefold())
+        return (rank, 0, 0, ingredient.name.casefold())
+
+    return [ingredient for ingredient, _, _
+            in sorted(candidates, key=order)[:limit]]
@@ -0,0 +1,54 @@
+"""Сводный список покупок пользователя."""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ShoppingListItem
+from .versions import get_version
+
+SHOPPING_LIST_KEY = 'shopping_list:{}:{}'
+
+
+def get_shopping_list(user):
+    """Суммы ингредиентов рецептов из списка покупок.
+
+    Возвращает кортежи (название, единица измерения, количество) из
+    таблицы ShoppingListItem, которую поддерживают сигналы.
+    Результат кешируется до изменения версии cart:<user>: её увеличивает
+    каждое изменение строк списка пользователя и переименование
+    ингредиента из него. Правки чужих рецептов кеш не сбрасывают.
+    """
+    key = SHOPPING_LIST_KEY.format(user.pk, get_version(f'cart:{user.pk}'))
+    shopping_list = cache.get(key)
+    if shopping_list is None:
+        shopping_list = list(ShoppingListItem.objects.filter(
+            user=user
+        ).values_list(
+            'ingredient__name',
+            'ingredient__measurement_unit',
+            'amount'
+        ).order_by('ingredient__name'))
+        cache.set(key, shopping_list, settings.RESPONSE_CACHE_TIMEOUT)
+    return shopping_list
+
+
+def check_shopping_lists(fix=False):
+    """Сверяет ShoppingListItem с корзинами, возвращает число расхождений.
+
+    Расхождения: отсутствующие строки, лишние строки и неверные суммы.
+    """
+    actual = ShoppingListItem.objects.actual()
+    stored = {
+        (user, ingredient): amount
+        for user, ingredient, amount in ShoppingListItem.objects.values_list(
+            'user', 'ingredient', 'amount')
+    }
+    drifted = {key for key in actual.keys() | stored.keys()
+               if actual.get(key) != stored.get(key)}
+    drift = {
+        'missing': len(drifted - stored.keys()),
+        'extra': len(drifted - actual.keys()),
+        'wrong': len(drifted & actual.keys() & stored.keys()),
+    }
+    if fix and drifted:
+        ShoppingListItem.objects.refresh({user for user, _ in drifted})
+    return drift
@@ -0,0 +1,100 @@
+from collections import Counter
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .counters import update_counters
+from .images import schedule_variants
+from .models import (FavoriteRecipe, Follow, Ingredient, IngredientAmount,
+                     Recipe, ShoppingCart, ShoppingListItem, Tag, User)
+from .relations import relations_changed
+from .versions import bump_version
+
+RECIPE_DATA_MODELS = (Recipe, IngredientAmount, Ingredient, Tag, User)
+
+
+def bump_recipes_version(sender, **kwargs):
+    bump_version('recipes')
+
+
+for model in RECIPE_DATA_MODELS:
+    post_save.connect(bump_recipes_version, sender=model)
+    post_delete.connect(bump_recipes_version, sender=model)
+m2m_changed.connect(bump_recipes_version, sender=Recipe.tags.through)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def bump_tags_version(sender, **kwargs):
+    bump_version('tags')
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def bump_ingredients_version(sender, **kwargs):
+    bump_version('ingredients')
+
+
+@receiver(post_save, sender=Ingredient)
+def bump_carts_on_ingredient_change(sender, instance, created, **kwargs):
+    # Название и единица измерения хранятся в кеше списков покупок.
+    if not created:
+        bump_version(*(
+            f'cart:{user}' for user in ShoppingListItem.objects.filter(
+                ingredient=instance).values_list('user', flat=True)))
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+def relation_saved(sender, instance, created, **kwargs):
+    if created:
+        relations_changed(sender, added=[instance])
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Follow)
+def relation_deleted(sender, instance, **kwargs):
+    relations_changed(sender, removed=[instance])
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        update_counters(sender, [instance], 1)
+
+
+@receiver(post_save, sender=Recipe)
+def build_image_variants(sender, instance, **kwargs):
+    schedule_variants(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    update_counters(sender, [instance], -1)
+
+
+@receiver(post_save, sender=IngredientAmount)
+def update_shopping_lists_on_save(sender, instance, created, **kwargs):
+    loaded = None if created else getattr(instance, 'loaded', None)
+    if not created and loaded is None:
+        # Прежние значения строки неизвестны: списки с рецептом
+        # пересчитываются целиком.
+        ShoppingListItem.objects.refresh(
+            ShoppingCart.objects.filter(
+                recipe_id=instance.recipe_id).values('user'))
+    else:
+        changes = Counter()
+        if loaded:
+            recipe, ingredient, amount = loaded
+            changes[recipe, ingredient] -= amount
+        changes[instance.recipe_id, instance.ingredient_id] += instance.amount
+        ShoppingListItem.objects.recipes_changed(changes)
+    instance.remember_loaded()
+
+
+@receiver(post_delete, sender=IngredientAmount)
+def update_shopping_lists_on_delete(sender, instance, **kwargs):
+    recipe, ingredient, amount = getattr(instance, 'loaded', None) or (
+        instance.recipe_id, instance.ingredient_id, instance.amount)
+    ShoppingListItem.objects.recipes_changed(
+        {(recipe, ingredient): -amount})
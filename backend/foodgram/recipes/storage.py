@@ -0,0 +1,59 @@
+"""Хранилище медиафайлов с именами по хешу содержимого."""
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+class ContentHashStorage(FileSystemStorage):
+    """Файл называется SHA-256 своего содержимого: каталог/хеш.расширение.
+
+    Одинаковые картинки хранятся один раз, а повторная загрузка той же
+    картинки (например, при каждом редактировании рецепта) только
+    обновляет время изменения файла. Файлы не удаляются вместе с
+    объектами: их могут использовать другие рецепты, неиспользуемые
+    удаляет команда collect_media_garbage.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        directory, filename = os.path.split(name)
+        _, extension = os.path.splitext(filename)
+        name = os.path.join(
+            directory, f'{content_hash(content)}{extension.lower()}')
+        try:
+            # Время изменения - для порога --min-age collect_media_garbage:
+            # старый файл с новой ссылкой, транзакция которой ещё не
+            # завершилась, не должен удаляться.
+            os.utime(self.path(name))
+        except FileNotFoundError:
+            pass
+        else:
+            return name
+        try:
+            return super().save(name, content, max_length)
+        except FileExistsError:
+            # Тот же файл успел записать параллельный запрос.
+            return name
+
+    def get_available_name(self, name, max_length=None):
+        # Занятое имя означает то же содержимое, а не конфликт, поэтому
+        # суффикс не подбирается. FileExistsError прерывает цикл
+        # повторных попыток в FileSystemStorage._save.
+        if self.exists(name):
+            raise FileExistsError(name)
+        return super().get_available_name(name, max_length)
@@ -0,0 +1,66 @@
+"""Счётчики версий данных для инвалидации кеша.
+
+Версия хранится в кеше Django под ключом version:<name>, время последнего
+изменения - под ключом modified:<name>. Запись в любую связанную таблицу
+увеличивает версию, поэтому ключи и ETag, построенные на её основе,
+устаревают без перебора самих ключей.
+
+Версия увеличивается только после фиксации транзакции: иначе читатель,
+пришедший между увеличением и фиксацией, сохранил бы старые данные под
+новой версией, и они отдавались бы до истечения кеша.
+"""
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+VERSION_KEY = 'version:{}'
+MODIFIED_KEY = 'modified:{}'
+
+
+def _initial_version():
+    # Версии, начинающиеся с текущего времени, не повторяются после
+    # перезапуска процесса или вытеснения ключа из кеша.
+    return time.time_ns() // 1000
+
+
+def get_versions(*names):
+    keys = [VERSION_KEY.format(name) for name in names]
+    found = cache.get_many(keys)
+    versions = {}
+    for name, key in zip(names, keys):
+        if key not in found:
+            cache.add(key, _initial_version(), timeout=None)
+            cache.add(MODIFIED_KEY.format(name), time.time(), timeout=None)
+            found[key] = cache.get(key)
+        versions[name] = found[key]
+    return versions
+
+
+def get_version(name):
+    return get_versions(name)[name]
+
+
+def get_last_modified(*names):
+    """Время последнего изменения любой из версий (Unix time)."""
+    get_versions(*names)
+    modified = cache.get_many([MODIFIED_KEY.format(name) for name in names])
+    return max(modified.values(), default=None)
+
+
+def increment_versions(names):
+    now = time.time()
+    for name in names:
+        try:
+            cache.incr(VERSION_KEY.format(name))
+        except ValueError:
+            get_version(name)
+        cache.set(MODIFIED_KEY.format(name), now, timeout=None)
+
+
+def bump_version(*names):
+    """Увеличивает версии после фиксации текущей транзакции.
+
+    Вне транзакции версии увеличиваются сразу.
+    """
+    transaction.on_commit(lambda: increment_versions(names))